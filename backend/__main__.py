@@ -1,4 +1,3 @@
-import json
 import logging
 import os
 import pathlib
@@ -9,7 +8,7 @@ import flask
 import flask_login
 import vocagen
 from .types import User
-from . import dbutils, resource_util
+from . import audio_sprites, audio_variants, dbutils, difficulty, image_variants, manifest, resource_util, response_cache
 
 
 IS_DEVEL = os.environ.get('FLASK_ENV', 'production').lower() == 'development'
@@ -24,6 +23,20 @@ login_manager.init_app(app)
 login_manager.login_view = 'login'
 
 
+# Seconds between checks for new or changed assets; 0 to disable
+WATCH_INTERVAL = float(os.environ.get("VOCAGEN_WATCH_INTERVAL", 5))
+if WATCH_INTERVAL > 0:
+    resource_util.watch(WATCH_INTERVAL)
+
+
+def get_pair(L1: str, L2: str) -> resource_util.LanguagePair:
+    """Snapshot of the language pair, the same one throughout a request even if a newer one is published meanwhile."""
+    pairs = flask.g.setdefault('pairs', {})
+    if (L1, L2) not in pairs:
+        pairs[L1, L2] = resource_util.get(L1, L2)
+    return pairs[L1, L2]
+
+
 def format_dict_keys(d):
     """Converts dict keys from snake_case to camelCase."""
     if isinstance(d, dict):
@@ -49,12 +62,24 @@ def getSupportedLanguages():
     return flask.jsonify(format_dict_keys({
         "pairs": [
             {"L1": L1, "L2": L2}
-            for L1, L2s in resource_util.langpair2root.keys()
+            for L1, L2s in resource_util.langpair2root.items()
             for L2 in L2s
         ]
     }))
 
 
+def parse_seed() -> int:
+    """State of the sentence order from the `seed` argument (hex). Random if missing or malformed."""
+    seed = flask.request.args.get('seed', None)
+    if seed is None:
+        return random.getrandbits(64)
+    try:
+        return int(seed, 16)
+    except ValueError:
+        logging.warning("Wrong value. Use random seed.")
+        return random.getrandbits(64)
+
+
 @app.route('/api/sentence/<string:L1>/<string:L2>/random')
 def random_sentence(L1: str, L2: str):
     """Return random sentence pair from L2 to L1."""
@@ -64,27 +89,14 @@ def random_sentence(L1: str, L2: str):
                                     {"per_language_pair": {L1: {L2: {"n_sentences": 1}}}})
     # Update user statistics done
     
-    # update seed
-    try:
-        seed = flask.request.args.get('seed', None)
-        print(seed)
-        if seed is None:
-            seed = random.getrandbits(64)
-        else:
-            s = int(seed, 16)
-    except ValueError:
-        logging.warning("Wrong value. Use random seed.")
-        s = random.getrandbits(64)
-    except TypeError:
-        logging.warning("Wrong type. Use random seed.")
-        s = random.getrandbits(64)
+    s = parse_seed()
     rlcg = vocagen.ReversibleRandom(s)
     action = flask.request.args.get('action', 'next')
     v = rlcg.next() if action == 'next' else rlcg.prev()
 
-    s_L2 = resource_util.L1_2_L2_2sentences_keys[L1][L2][int(v % len(resource_util.L1_2_L2_2sentences[L1][L2]))]
-    sentence = load_sentence(L1, L2, s_L2)
-    return flask.jsonify(format_dict_keys({
+    keys = get_pair(L1, L2).sentences_keys
+    sentence = sentence_json(L1, L2, keys[int(v % len(keys))])
+    return response_cache.response(format_dict_keys({
         'sentence': sentence,
         'state': hex(v)[2:],
     }))
@@ -99,105 +111,214 @@ def length_sorted_sentence(L1: str, L2: str):
                                     {"per_language_pair": {L1: {L2: {"n_sentences": 1}}}})
     # Update user statistics done
 
-    # update seed
-    try:
-        seed = flask.request.args.get('seed', None)
-        if seed is None:
-            seed = random.getrandbits(64)
-        else:
-            s = int(seed, 16)
-    except ValueError:
-        logging.warning("Wrong value. Use random seed.")
-        s = random.getrandbits(64)
-    except TypeError:
-        logging.warning("Wrong type. Use random seed.")
-        s = random.getrandbits(64)
+    s = parse_seed()
     action = flask.request.args.get('action', 'next')
-    v = s + 1 if action == 'next' else s - 1
+    keys = get_pair(L1, L2).sentences_keys
+    # Step first, then show the sentence at the new position, like `random`
+    v = (s + 1 if action == 'next' else s - 1) % len(keys)
 
-    resource_util.L1_2_L2_2sentences_keys[L1][L2][int(s % len(resource_util.L1_2_L2_2sentences[L1][L2]))]
-    s_L2 = resource_util.L1_2_L2_2sentences_keys[L1][L2][int(s % len(resource_util.L1_2_L2_2sentences[L1][L2]))]
-    sentence = load_sentence(L1, L2, s_L2)
-    return flask.jsonify(format_dict_keys({
+    sentence = sentence_json(L1, L2, keys[v])
+    return response_cache.response(format_dict_keys({
         'sentence': sentence,
         'state': hex(v)[2:],
     }))
 
 
+MAX_BATCH_SIZE = 50
+
+
+@app.route('/api/sentence/<string:L1>/<string:L2>/batch')
+def batch_sentence(L1: str, L2: str):
+    """Return `n` consecutive sentence pairs and the state after the last one.
+
+    Same as calling `random` (`mode=random`) or `length` (`mode=length`) `n` times,
+    passing each returned state as the next seed.
+    """
+    n = min(max(flask.request.args.get('n', 10, type=int), 1), MAX_BATCH_SIZE)
+    mode = flask.request.args.get('mode', 'random')
+    action = flask.request.args.get('action', 'next')
+    s = parse_seed()
+
+    keys = get_pair(L1, L2).sentences_keys
+    if mode == 'random':
+        rlcg = vocagen.ReversibleRandom(s)
+        vs = [int(v) for v in (rlcg.next_n(n) if action == 'next' else rlcg.prev_n(n))]
+        positions = vs
+        state = vs[-1]
+    elif mode == 'length':
+        step = 1 if action == 'next' else -1
+        positions = [s + step * (i + 1) for i in range(n)]
+        state = (s + step * n) % len(keys)
+    else:
+        return flask.Response(f"Unknown mode {mode}", status=400)
+
+    # Update user statistics
+    if flask_login.current_user:
+        dbutils.update_user_statistics(flask_login.current_user,
+                                    {"per_language_pair": {L1: {L2: {"n_sentences": n}}}})
+    # Update user statistics done
+
+    return response_cache.response(format_dict_keys({
+        'sentences': [sentence_json(L1, L2, keys[p % len(keys)]) for p in positions],
+        'state': hex(state)[2:],
+    }))
+
+
+@app.route('/api/sentence/<string:L1>/<string:L2>/difficulty')
+def difficulty_sentence(L1: str, L2: str):
+    """Return a page of sentence pairs whose difficulty is within [`min`, `max`], easiest first.
+
+    `metric` is one of `difficulty.METRICS`: `length` (characters), `n_tokens` (words) or
+    `max_rank` (frequency rank of the rarest word). The response also gives the number of
+    sentences in the band and the range of the metric over all sentences, e.g. for a slider.
+    """
+    metric = flask.request.args.get('metric', 'max_rank')
+    if metric not in difficulty.METRICS:
+        return flask.Response(f"Unknown metric {metric}", status=400)
+    pair = get_pair(L1, L2)
+    lowest, highest = pair.difficulty.range(metric)
+    lo = flask.request.args.get('min', lowest, type=int)
+    hi = flask.request.args.get('max', highest, type=int)
+    offset = max(flask.request.args.get('offset', 0, type=int), 0)
+    n = min(max(flask.request.args.get('n', 10, type=int), 1), MAX_BATCH_SIZE)
+
+    band = pair.difficulty.band(metric, lo, hi)
+    sentences = [sentence_json(L1, L2, int(i)) for i in band[offset:offset + n]]
+
+    # Update user statistics
+    if flask_login.current_user:
+        dbutils.update_user_statistics(flask_login.current_user,
+                                    {"per_language_pair": {L1: {L2: {"n_sentences": len(sentences)}}}})
+    # Update user statistics done
+
+    return response_cache.response(format_dict_keys({
+        'sentences': sentences,
+        'total': len(band),
+        'range': [lowest, highest],
+    }))
+
+
+@app.route('/api/search/<string:L1>/<string:L2>')
+def search(L1: str, L2: str):
+    """Return a page of sentence pairs containing every word of `q`, in either language.
+
+    Sentences with more common words come first (frequency rank of the rarest word), then shorter ones.
+    """
+    q = flask.request.args.get('q', '')
+    offset = max(flask.request.args.get('offset', 0, type=int), 0)
+    n = min(max(flask.request.args.get('n', 10, type=int), 1), MAX_BATCH_SIZE)
+    pair = get_pair(L1, L2)
+    found = pair.difficulty.sort(pair.search.search(q, L1, L2), 'max_rank')
+    return response_cache.response(format_dict_keys({
+        'sentences': [sentence_json(L1, L2, int(i)) for i in found[offset:offset + n]],
+        'total': len(found),
+    }))
+
+
 @app.route('/api/word/<string:L1>/<string:L2>/random')
 def random_word(L1: str, L2: str):
     """Return random sentence pair from L2 to L1."""
-    try:
-        seed = flask.request.args.get('seed', None)
-        if seed is None:
-            seed = random.getrandbits(64)
-        else:
-            s = int(seed, 16)
-    except ValueError:
-        logging.warning("Wrong value. Use random seed.")
-        s = random.getrandbits(64)
-    except TypeError:
-        logging.warning("Wrong type. Use random seed.")
-        s = random.getrandbits(64)
+    s = parse_seed()
     rlcg = vocagen.ReversibleRandom(s)
     action = flask.request.args.get('action', 'next')
 
-    for i_try in range(10):  # Try 10 times
-        files = resource_util.L1_2_L2_2words[L1][L2]
-        v = rlcg.next() if action == 'next' else rlcg.prev()
-        wordfile = files[int(v % len(files))]
-        worddata = json.loads(wordfile.read_text())
-
-        # Update user statistics
-        if flask_login.current_user:
-            dbutils.update_user_statistics(flask_login.current_user,
-                                        {"per_language_pair": {L1: {L2: {"n_sentences": len(worddata['sentences'])}}}})
-        # Update user statistics done
-
-        try:
-            return flask.jsonify(format_dict_keys({
-                'sentences': [load_sentence(L1, L2, s_L2) for s_L2 in worddata['sentences']],
-                'word': worddata['word'],
-                'state': hex(v)[2:],
-            }))
-        except FileNotFoundError:
-            logging.warning("Failed to load %s. Retry (%s).", wordfile, i_try)
-            continue
-    raise FileNotFoundError("No valid word found.")
-
-
-def load_sentence(L1: str, L2: str, s_L2: str):
-    try:
-        s_L1 = resource_util.L1_2_L2_2sentences[L1][L2][s_L2]
-    except KeyError:
-        raise FileNotFoundError(f"Translation for {s_L2} not found.")
-
-    id_L1 = resource_util.sentence2id(s_L1)
-    id_L2 = resource_util.sentence2id(s_L2)
-    audio_L1s = sorted((resource_util.langpair2root[L1][L2] / 'audio').glob(f"{id_L1}_*.mp3"))
-    if len(audio_L1s) == 0:
-        raise FileNotFoundError(f"Audio file for {id_L1} not found.")
-    if len(audio_L1s) != 1:
-        warnings.warn(f"Found {len(audio_L1s)} audio files for {id_L1}, expected 1.")
-    audio_L1 = audio_L1s[0]
-
-    audio_urls = [
-        app.url_for('audio', L1=L1, L2=L2, filename=audio_L1.name),
-        *[
-            app.url_for('audio', L1=L1, L2=L2, filename=p.name)
-            for p in sorted((resource_util.langpair2root[L1][L2] / 'audio').glob(f"{id_L2}_*.mp3"))
-        ]
-    ]
-    if L1 == "en":
-        id = id_L1
-    elif L2 == "en":
-        id = id_L2
-    else:
-        raise NotImplementedError(f"Unsupported language pair {L1} -> {L2} (Should include English).")
+    # Words with missing assets are already excluded from the index
+    pair = get_pair(L1, L2)
+    v = rlcg.next() if action == 'next' else rlcg.prev()
+    i = pair.words_keys[int(v % len(pair.words_keys))]
+    sentences = pair.words.sentences(i)
+
+    # Update user statistics
+    if flask_login.current_user:
+        dbutils.update_user_statistics(flask_login.current_user,
+                                    {"per_language_pair": {L1: {L2: {"n_sentences": len(sentences)}}}})
+    # Update user statistics done
+
+    return response_cache.response(format_dict_keys({
+        'sentences': [sentence_json(L1, L2, j) for j in sentences],
+        'word': pair.words.word(i),
+        'state': hex(v)[2:],
+    }))
+
+
+MAX_WORDS_PAGE_SIZE = 500
+
+
+@app.route('/api/words/<string:L1>/<string:L2>')
+def words(L1: str, L2: str):
+    """Return a page of words in frequency rank order."""
+    offset = max(flask.request.args.get('offset', 0, type=int), 0)
+    limit = min(max(flask.request.args.get('limit', 100, type=int), 0), MAX_WORDS_PAGE_SIZE)
+    pair = get_pair(L1, L2)
+    keys = pair.words_keys[offset:offset + limit]
+    return flask.jsonify(format_dict_keys({
+        'words': [
+            {'word': pair.words.word(i), 'rank': pair.words.rank(i), 'n_sentences': len(pair.words.sentences(i))}
+            for i in keys
+        ],
+        'total': len(pair.words_keys),
+    }))
+
+
+# camelCase JSON of sentences, see `sentence_json`
+sentence_cache = response_cache.FragmentCache(response_cache.MAX_BYTES)
+
+
+def sentence_json(L1: str, L2: str, i: int) -> response_cache.RawJSON:
+    """`load_sentence`, serialized in camelCase and cached per version of the pair and display width."""
+    pair = get_pair(L1, L2)
+    key = (L1, L2, pair.version, i, flask.request.args.get('w', type=int))
+    fragment = sentence_cache.get(key)
+    if fragment is None:
+        fragment = response_cache.RawJSON(response_cache.dumps(format_dict_keys(load_sentence(L1, L2, i))))
+        sentence_cache.put(key, fragment)
+    return fragment
+
+
+def load_sentence(L1: str, L2: str, i: int):
+    """Sentence pair at index `i` of the sentence store."""
+    pair = get_pair(L1, L2)
+    store = pair.sentences
+    s_L1, s_L2 = store.sentence_L1(i), store.sentence_L2(i)
+
+    id_L2 = store.id_L2(i)
+    assets = pair.id2assets.get(id_L2)
+    if assets is None or not assets.complete:
+        raise FileNotFoundError(f"Audio file for {id_L2} not found.")
+    id_L1 = assets.id_L1
+    if len(assets.voices_L1) != 1:
+        warnings.warn(f"Found {len(assets.voices_L1)} audio files for {id_L1}, expected 1.")
+
+    stems = assets.audio_stems
+    audio_urls = [app.url_for('audio', L1=L1, L2=L2, filename=f"{stem}.mp3") for stem in stems]
+    # Compact encodings of the same files, offered if every file of the sentence has been transcoded
+    audio_variant_urls = {
+        name: {
+            "mimetype": variant.mimetype,
+            "urls": [
+                app.url_for('audio_variant', L1=L1, L2=L2, variant=name, filename=variant.filename(stem))
+                for stem in stems
+            ],
+        }
+        for name, variant in audio_variants.VARIANTS.items()
+        if all(stem in pair.audio_variants[name] for stem in stems)
+    }
+    # All of the files in one, played by seeking to the segments, if it has been built
+    sprite = pair.audio_sprites.get(audio_sprites.sprite_name(stems))
+    audio_sprite = None if sprite is None else {
+        "url": app.url_for('audio_sprite', L1=L1, L2=L2, filename=audio_sprites.filename(stems)),
+        "segments": [
+            {"byte_start": b0, "byte_end": b1, "ms_start": t0, "ms_end": t1}
+            for b0, b1, t0, t1 in sprite["segments"]
+        ],
+    }
+    id = manifest.image_id(L1, L2, id_L1, id_L2)
 
     is_success, _, (l1, l2, filename) = filepath_image(L1, L2, f"{id}.png")
-    image_url_horizontal = app.url_for('image_horizontal', L1=l1, L2=l2, filename=filename)
-    image_url_vertical = app.url_for('image_vertical', L1=l1, L2=l2, filename=filename)
+    # Pass on the display width, if the client gave one, to pick the image size
+    image_args = {} if (w := flask.request.args.get('w', type=int)) is None else {"w": w}
+    image_url_horizontal = app.url_for('image_horizontal', L1=l1, L2=l2, filename=filename, **image_args)
+    image_url_vertical = app.url_for('image_vertical', L1=l1, L2=l2, filename=filename, **image_args)
     return {
         "id_L1": id_L1,
         "id_L2": id_L2,
@@ -206,25 +327,69 @@ def load_sentence(L1: str, L2: str, s_L2: str):
         "sentence1": s_L1,
         "sentence2": s_L2,
         "audio_urls": audio_urls,
+        "audio_variants": audio_variant_urls,
+        "audio_sprite": audio_sprite,
         "image_url_horizontal": image_url_horizontal,
         "image_url_vertical": image_url_vertical,
         "image_is_random": not is_success,
     }
 
+# Asset file names are sentence hashes, so a URL always refers to the same content
+CACHE_CONTROL_IMMUTABLE = "public, max-age=31536000, immutable"
+# A stand-in that is replaced once the real asset is generated
+CACHE_CONTROL_STAND_IN = "public, max-age=3600"
+
+
+def send_asset(filepath: pathlib.Path, mimetype: str, cache_control: str | None):
+    """Send an asset with a strong ETag, answering conditional and range requests.
+
+    `cache_control` None marks a random stand-in: it must not be cached, nor revalidated by ETag.
+    """
+    if cache_control is None:
+        resp = flask.send_file(filepath.absolute(), mimetype=mimetype, etag=False, conditional=False)
+        resp.headers["Cache-Control"] = "no-store"
+        resp.headers["Vary"] = "*"
+        return resp
+    st = filepath.stat()
+    etag = f"{filepath.parent.name}-{filepath.stem}-{st.st_mtime_ns:x}-{st.st_size:x}"
+    resp = flask.send_file(filepath.absolute(), mimetype=mimetype, etag=etag, conditional=True)
+    resp.headers["Cache-Control"] = cache_control
+    return resp
+
+
+def send_image(pair: resource_util.LanguagePair, filepath: pathlib.Path, cache_control: str | None):
+    """Send the derivative of a PNG best fitting the request's `Accept` header and `w` argument, or the PNG itself."""
+    directory = filepath.parent.name
+    variant = image_variants.choose(
+        pair.image_derivatives[directory].get(filepath.stem, []),
+        flask.request.accept_mimetypes, flask.request.args.get('w', type=int),
+    )
+    if variant is None:
+        resp = send_asset(filepath, 'image/png', cache_control)
+    else:
+        width, ext = variant
+        derived = image_variants.derived_dir(pair.root, directory) / image_variants.filename(filepath.stem, width, ext)
+        resp = send_asset(derived, image_variants.FORMATS[ext], cache_control)
+    if cache_control is not None:
+        resp.vary.add("Accept")
+    return resp
+
+
 @app.route("/assets/<string:L1>/<string:L2>/image-horizontal/<string:filename>")
 def image_horizontal(L1: str, L2: str, filename: str):
-    _, filepath, _ = filepath_image(L1, L2, filename)
-    return flask.send_file(filepath.absolute(), mimetype='image/png')
+    is_success, filepath, _ = filepath_image(L1, L2, filename)
+    return send_image(get_pair(L1, L2), filepath, CACHE_CONTROL_IMMUTABLE if is_success else None)
 
 
 @app.route("/assets/<string:L1>/<string:L2>/image-vertical/<string:filename>")
 def image_vertical(L1: str, L2: str, filename: str):
-    _, filepath, _ = filepath_image(L1, L2, filename)
-    filepath2 = pathlib.Path(filepath.as_posix().replace("-horizontal", "-vertical"))
-    try:
-        return flask.send_file(filepath2.absolute(), mimetype='image/png')
-    except FileNotFoundError:
-        return flask.send_file(filepath.absolute(), mimetype='image/png')
+    pair = get_pair(L1, L2)
+    id = pathlib.Path(filename).stem
+    if filename == f"{id}.png" and id in pair.images_vertical:
+        return send_image(pair, pair.root / 'image-vertical' / filename, CACHE_CONTROL_IMMUTABLE)
+    # Horizontal image in place of the vertical one, until it is generated
+    is_success, filepath, _ = filepath_image(L1, L2, filename)
+    return send_image(pair, filepath, CACHE_CONTROL_STAND_IN if is_success else None)
 
 
 @login_manager.user_loader
@@ -262,12 +427,15 @@ def register():
 
 
 def filepath_image(L1, L2, filename: str):
-    filepath = resource_util.langpair2root[L1][L2] / 'image-horizontal' / filename
-    if filepath.exists():
+    pair = get_pair(L1, L2)
+    filepath = pair.root / 'image-horizontal' / filename
+    stem = pathlib.Path(filename).stem
+    # Images are PNG; derivatives are chosen by the Accept header, not by the extension
+    if filename == f"{stem}.png" and stem in pair.images_horizontal:
         return True, filepath, (L1, L2, filename),
     else:
         print(f"File not found {filepath}. Fallback to random image.")
-        filepath = random.choice(resource_util.L1_2_L2_2images[L1][L2])
+        filepath = random.choice(pair.images)
         return False, filepath, (L1, L2, filename),
 
 
@@ -299,9 +467,36 @@ def audio(L1: str, L2: str, filename: str):
     # In production, nginx should serve the static files.
     if not IS_DEVEL:
         raise ValueError("This should not be called in production.")
-    return flask.send_from_directory(
-        (resource_util.langpair2root[L1][L2] / 'audio').absolute(), filename,
-        mimetype="audio/mp3", conditional=True)
+    # `filename` has no slashes, see the route
+    filepath = resource_util.langpair2root[L1][L2] / 'audio' / filename
+    if not filepath.is_file():
+        flask.abort(404)
+    return send_asset(filepath, "audio/mpeg", CACHE_CONTROL_IMMUTABLE)
+
+
+@app.route('/assets/<string:L1>/<string:L2>/audio-sprite/<string:filename>')
+def audio_sprite(L1: str, L2: str, filename: str):
+    # In production, nginx should serve the static files.
+    if not IS_DEVEL:
+        raise ValueError("This should not be called in production.")
+    filepath = resource_util.langpair2root[L1][L2] / audio_sprites.DIRECTORY / filename
+    if not filepath.is_file() or filepath.suffix != ".mp3":
+        flask.abort(404)
+    return send_asset(filepath, "audio/mpeg", CACHE_CONTROL_IMMUTABLE)
+
+
+@app.route('/assets/<string:L1>/<string:L2>/audio-<string:variant>/<string:filename>')
+def audio_variant(L1: str, L2: str, variant: str, filename: str):
+    # In production, nginx should serve the static files.
+    if not IS_DEVEL:
+        raise ValueError("This should not be called in production.")
+    if variant not in audio_variants.VARIANTS:
+        flask.abort(404)
+    v = audio_variants.VARIANTS[variant]
+    filepath = resource_util.langpair2root[L1][L2] / v.directory / filename
+    if not filepath.is_file():
+        flask.abort(404)
+    return send_asset(filepath, v.mimetype, CACHE_CONTROL_IMMUTABLE)
 
 
 if IS_DEVEL:
@@ -0,0 +1,37 @@
+"""All audio files of a sentence packed into one MP3, so that clients fetch a sentence in one request.
+
+`python -m backend.tools.build_audio_sprites` writes them, with the offsets of each file in a manifest:
+
+    <root>/audio-sprite/<name>.mp3
+    <root>/audio-sprite/sprites.json  # name -> {"stems": [...], "segments": [[byte_start, byte_end, ms_start, ms_end], ...]}
+
+The name is derived from the stems, so a sprite's URL changes when the voices of its sentence do.
+"""
+import hashlib
+import json
+import pathlib
+
+DIRECTORY = "audio-sprite"
+MANIFEST_FILENAME = "sprites.json"
+
+
+def sprite_name(stems: list[str]) -> str:
+    return hashlib.sha256("\n".join(stems).encode("utf8")).hexdigest()[:32]
+
+
+def filename(stems: list[str]) -> str:
+    return f"{sprite_name(stems)}.mp3"
+
+
+def load(root: pathlib.Path) -> dict[str, dict]:
+    """Sprite name -> stems and segments. Empty if no sprites have been built."""
+    try:
+        return json.loads((root / DIRECTORY / MANIFEST_FILENAME).read_text())
+    except (FileNotFoundError, json.decoder.JSONDecodeError):
+        return {}
+
+
+def save(root: pathlib.Path, sprites: dict[str, dict]) -> None:
+    tmp = root / DIRECTORY / f".{MANIFEST_FILENAME}.tmp"
+    tmp.write_text(json.dumps(sprites))
+    tmp.replace(root / DIRECTORY / MANIFEST_FILENAME)
@@ -0,0 +1,47 @@
+"""Compact encodings of the TTS audio, offered next to the MP3s.
+
+`python -m backend.tools.transcode_audio` writes them into one directory per variant:
+
+    <root>/audio-opus/<id>_<voice>.opus
+"""
+import dataclasses
+import os
+import pathlib
+
+
+@dataclasses.dataclass(frozen=True)
+class Variant:
+    name: str
+    ext: str
+    mimetype: str
+    # ffmpeg output options
+    ffmpeg_args: tuple[str, ...]
+
+    @property
+    def directory(self) -> str:
+        return f"audio-{self.name}"
+
+    def filename(self, stem: str) -> str:
+        return f"{stem}.{self.ext}"
+
+
+# Speech-tuned, mono. Opus for most browsers, AAC for the ones without Opus support.
+VARIANTS = {
+    v.name: v for v in [
+        Variant("opus", "opus", "audio/ogg", ("-c:a", "libopus", "-b:a", "24k", "-application", "voip", "-ac", "1", "-f", "ogg")),
+        Variant("aac", "m4a", "audio/mp4", ("-c:a", "aac", "-b:a", "32k", "-ac", "1", "-movflags", "+faststart", "-f", "mp4")),
+    ]
+}
+
+
+def scan(root: pathlib.Path) -> dict[str, set[str]]:
+    """Variant name -> stems (`<id>_<voice>`) of the files available."""
+    ret = {}
+    for variant in VARIANTS.values():
+        suffix = f".{variant.ext}"
+        try:
+            with os.scandir(root / variant.directory) as it:
+                ret[variant.name] = {e.name[:-len(suffix)] for e in it if e.name.endswith(suffix)}
+        except FileNotFoundError:
+            ret[variant.name] = set()
+    return ret
@@ -1,52 +1,170 @@
-"""Mock database"""
+"""User database, backed by SQLite"""
+import atexit
+import logging
+import os
 import pathlib
+import sqlite3
+import threading
+import time
 from .types import User, LanguagePairStatistics, Statistics
-import json
 ANONYMOUS_ID = 'anonymous'
+DB_PATH = pathlib.Path(os.environ.get("VOCAGEN_USERDB", "userdb/users.sqlite3"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS credentials (
+    email TEXT PRIMARY KEY,
+    password TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS statistics (
+    email TEXT PRIMARY KEY,
+    n_reports INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS language_pair_statistics (
+    email TEXT NOT NULL,
+    L1 TEXT NOT NULL,
+    L2 TEXT NOT NULL,
+    total_seconds REAL NOT NULL DEFAULT 0,
+    n_sentences INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (email, L1, L2)
+);
+CREATE TABLE IF NOT EXISTS achievements (
+    email TEXT NOT NULL,
+    achievement TEXT NOT NULL,
+    PRIMARY KEY (email, achievement)
+);
+"""
+
+_local = threading.local()
+
+
+def _connect() -> sqlite3.Connection:
+    """Connection of the current thread."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(DB_PATH, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        _local.conn = conn
+    return conn
+
 
 def verify_and_get_user(uid, password):
-    try:
-        text = pathlib.Path("userdb/credentials.txt").read_text()
-    except FileNotFoundError:
+    row = _connect().execute("SELECT password FROM credentials WHERE email = ?", (uid,)).fetchone()
+    if row is None or row[0] != password:
         return None
-
-    for l in text.splitlines():
-        if l == "":
-            continue
-        if (uid, password) == l.split(","):
-            return User(uid)
-    return None
+    return User(uid)
 
 
 def register_credentials(uid: str, password: str) -> bool:
-    if verify_and_get_user(uid, password) is not None:
+    conn = _connect()
+    with conn:
+        cursor = conn.execute("INSERT OR IGNORE INTO credentials (email, password) VALUES (?, ?)", (uid, password))
+    if cursor.rowcount == 0:
         return False
-    with pathlib.Path("userdb/credentials.txt").open("a") as f:
-        f.write(f"{uid},{password}\n")
     return User(uid)
 
-def _get_user_statistics_file(user: User) -> pathlib.Path:
+
+def _get_user_email(user: User) -> str:
     try:
-        fileid = user.email.replace("@", ",")  # As "," is not allowed in email
+        return user.email
     except:
-        fileid = ANONYMOUS_ID
-    return pathlib.Path(f"userdb/{fileid}.json")
+        return ANONYMOUS_ID
+
+
+def _read_user_statistics(conn: sqlite3.Connection, email: str) -> dict:
+    stat = Statistics.new(email)
+    row = conn.execute("SELECT n_reports FROM statistics WHERE email = ?", (email,)).fetchone()
+    if row is not None:
+        stat.n_reports = row[0]
+    for L1, L2, total_seconds, n_sentences in conn.execute(
+            "SELECT L1, L2, total_seconds, n_sentences FROM language_pair_statistics WHERE email = ?", (email,)):
+        stat.per_language_pair.setdefault(L1, {})[L2] = LanguagePairStatistics(L1, L2, total_seconds, n_sentences)
+    stat.achievements = [a for a, in conn.execute("SELECT achievement FROM achievements WHERE email = ?", (email,))]
+    return stat.to_dict()
+
+
+def _write_user_statistics(conn: sqlite3.Connection, email: str, counter: dict):
+    """Add a nested counter of increments (same shape as `Statistics.to_dict`) to the rows."""
+    if "n_reports" in counter:
+        conn.execute(
+            "INSERT INTO statistics (email, n_reports) VALUES (?, ?) "
+            "ON CONFLICT (email) DO UPDATE SET n_reports = n_reports + excluded.n_reports",
+            (email, counter["n_reports"]))
+    for L1, L2_2_counter in counter.get("per_language_pair", {}).items():
+        for L2, c in L2_2_counter.items():
+            conn.execute(
+                "INSERT INTO language_pair_statistics (email, L1, L2, total_seconds, n_sentences) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (email, L1, L2) DO UPDATE SET "
+                "total_seconds = total_seconds + excluded.total_seconds, n_sentences = n_sentences + excluded.n_sentences",
+                (email, L1, L2, c.get("total_seconds", 0), c.get("n_sentences", 0)))
+
 
 def get_user_statistics(user: User) -> Statistics:
-    try:
-        return Statistics.from_dict(json.loads(_get_user_statistics_file(user).read_text()))
-    except FileNotFoundError:
-        if isinstance(user, User):
-            return Statistics.new(user.email)
-        else:
-            return Statistics.new(ANONYMOUS_ID)
+    """Statistics in the database, plus the increments not flushed yet."""
+    email = _get_user_email(user)
+    with _flush_lock:  # Not to miss the increments being written
+        stat = _read_user_statistics(_connect(), email)
+        with _pending_lock:
+            if email in _pending:
+                _add_nested_counter(stat, _pending[email])
+    return Statistics.from_dict(stat)
+
+
+# Statistics are updated on every request, so increments are aggregated in memory
+# and written behind by a background thread instead of updating the database each time.
+FLUSH_INTERVAL_SECONDS = float(os.environ.get("VOCAGEN_STATISTICS_FLUSH_INTERVAL", 5))
+# email -> nested counter of increments
+_pending: dict[str, dict] = {}
+_pending_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_flusher: threading.Thread | None = None
+
 
 def update_user_statistics(user: User, data: dict):
-    stat = get_user_statistics(user).to_dict()
-    _add_nested_counter(stat, data)
-    _get_user_statistics_file(user).write_text(json.dumps(stat))
+    global _flusher
+    with _pending_lock:
+        _add_nested_counter(_pending.setdefault(_get_user_email(user), {}), data)
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flush_periodically, daemon=True)
+            _flusher.start()
     return
 
+
+def flush_user_statistics():
+    """Write the aggregated increments to the database in a single transaction."""
+    global _pending
+    with _flush_lock:
+        with _pending_lock:
+            pending, _pending = _pending, {}
+        if not pending:
+            return
+        conn = _connect()
+        try:
+            with conn:
+                for email, counter in pending.items():
+                    _write_user_statistics(conn, email, counter)
+        except Exception:
+            # Rolled back; keep the increments for the next flush
+            with _pending_lock:
+                for email, counter in pending.items():
+                    _add_nested_counter(_pending.setdefault(email, {}), counter)
+            raise
+
+
+def _flush_periodically():
+    while True:
+        time.sleep(FLUSH_INTERVAL_SECONDS)
+        try:
+            flush_user_statistics()
+        except Exception:
+            logging.exception("Failed to flush user statistics.")
+
+
+atexit.register(flush_user_statistics)
+
+
 def _add_nested_counter(counter: dict, counter2: dict):
     for k, v in counter2.items():
         if isinstance(v, dict):
@@ -0,0 +1,139 @@
+"""Difficulty of the sentences of a language pair, for picking sentences of a level.
+
+Per sentence store index, three measures of the L2 sentence:
+    length     number of characters
+    n_tokens   number of words
+    max_rank   highest frequency rank (`frequency.csv`) of its words, i.e. the rarest word;
+               words not in the list (inflections, names) are ignored, 0 if none is listed
+
+They are kept in `difficulty.npz` in the pair's root, with the sentence indices
+sorted by each measure, so that a band of difficulty is found by binary search.
+"""
+import csv
+import pathlib
+
+import numpy as np
+
+from . import tokenizer
+from .sentence_store import SentenceStore, STORE_FILENAME
+
+INDEX_FILENAME = "difficulty.npz"
+METRICS = ("length", "n_tokens", "max_rank")
+# Longest word matched when segmenting unsegmented languages against the frequency list
+MAX_WORD_LENGTH = 16
+
+
+def read_ranks(frequency_csv: pathlib.Path) -> dict[str, int]:
+    """Word -> rank of `frequency.csv`. Empty if there is none.
+
+    Columns are read by position (rank, frequency, word, ...), since the header names
+    vary between lists, e.g. `word` or `word_hi`.
+    """
+    ranks = {}
+    try:
+        with frequency_csv.open(newline="", encoding="utf-8") as f:
+            rows = csv.reader(f)
+            next(rows, None)  # header
+            for rank, _, word, *_ in rows:
+                ranks.setdefault(word.lower(), int(rank))
+    except FileNotFoundError:
+        pass
+    return ranks
+
+
+def _segment(run: str, ranks: dict[str, int]) -> list[str]:
+    """Longest-match segmentation of a run of unsegmented text. Unknown characters are words of their own."""
+    words = []
+    i = 0
+    while i < len(run):
+        for j in range(min(len(run), i + MAX_WORD_LENGTH), i, -1):
+            if j == i + 1 or run[i:j] in ranks:
+                words.append(run[i:j])
+                i = j
+                break
+    return words
+
+
+def tokenize(text: str, lang: str, ranks: dict[str, int]) -> list[str]:
+    words = tokenizer.words(text)
+    if lang in tokenizer.UNSEGMENTED_LANGUAGES:
+        words = [w for run in words for w in _segment(run, ranks)]
+    return words
+
+
+def convert(store: SentenceStore, lang: str, ranks: dict[str, int]) -> dict[str, np.ndarray]:
+    n = len(store)
+    values = {metric: np.zeros(n, dtype=np.uint32) for metric in METRICS}
+    for i in range(n):
+        s = store.sentence_L2(i)
+        words = tokenize(s, lang, ranks)
+        values["length"][i] = len(s)
+        values["n_tokens"][i] = len(words)
+        values["max_rank"][i] = max((ranks.get(w, 0) for w in words), default=0)
+    arrays = dict(values)
+    for metric in METRICS:
+        arrays[f"{metric}_order"] = np.argsort(values[metric], kind="stable").astype(np.uint32)
+    return arrays
+
+
+class DifficultyIndex:
+    """Servable sentences sorted by each measure."""
+
+    def __init__(self, arrays: dict[str, np.ndarray], servable: np.ndarray) -> None:
+        """`servable`: bool per sentence store index."""
+        self._servable = servable
+        # As loaded, per sentence store index
+        self.arrays = arrays
+        self._values = {}
+        self._orders = {}
+        for metric in METRICS:
+            order = arrays[f"{metric}_order"]
+            order = order[servable[order]]
+            self._orders[metric] = order
+            self._values[metric] = arrays[metric][order]
+
+    def band(self, metric: str, lo: int, hi: int) -> np.ndarray:
+        """Sentence store indices whose `metric` is in [lo, hi], easiest first."""
+        values = self._values[metric]
+        start = np.searchsorted(values, lo, side="left")
+        end = np.searchsorted(values, hi, side="right")
+        return self._orders[metric][start:end]
+
+    def sort(self, indices: np.ndarray, metric: str) -> np.ndarray:
+        """The servable ones of the sentence store `indices`, easiest first by `metric`, then in store order."""
+        indices = indices[self._servable[indices]]
+        return indices[np.lexsort((indices, self.arrays[metric][indices]))]
+
+    def range(self, metric: str) -> tuple[int, int]:
+        """Lowest and highest value of `metric`, (0, 0) if there are no sentences."""
+        values = self._values[metric]
+        return (int(values[0]), int(values[-1])) if len(values) else (0, 0)
+
+
+def _mtime(path: pathlib.Path) -> float:
+    try:
+        return path.stat().st_mtime
+    except FileNotFoundError:
+        return 0
+
+
+def is_fresh(root: pathlib.Path, translation_json: pathlib.Path) -> bool:
+    """Whether `difficulty.npz` is newer than the sentences and `frequency.csv`."""
+    mtime = _mtime(root / INDEX_FILENAME)
+    if mtime == 0:
+        return False
+    return max(_mtime(root / STORE_FILENAME), _mtime(translation_json), _mtime(root / "frequency.csv")) <= mtime
+
+
+def save(root: pathlib.Path, store: SentenceStore, lang: str) -> None:
+    tmp = root / f"{INDEX_FILENAME}.tmp.npz"
+    np.savez(tmp, **convert(store, lang, read_ranks(root / "frequency.csv")))
+    tmp.replace(root / INDEX_FILENAME)
+
+
+def load_or_convert(root: pathlib.Path, translation_json: pathlib.Path, store: SentenceStore, lang: str) -> dict[str, np.ndarray]:
+    """Load `difficulty.npz`, or compute the measures in memory if it is missing or outdated."""
+    if is_fresh(root, translation_json):
+        with np.load(root / INDEX_FILENAME) as f:
+            return {k: f[k] for k in f.files}
+    return convert(store, lang, read_ranks(root / "frequency.csv"))
@@ -0,0 +1,63 @@
+"""Smaller encodings of the PNG images, chosen per request.
+
+`python -m backend.tools.build_image_derivatives` writes WebP (and optionally
+AVIF) images at a few widths next to the originals:
+
+    <root>/image-horizontal-derived/<id>-<width>.webp
+
+The image routes pick the smallest width at least as large as the `w` query
+parameter, in the best format the client's `Accept` header allows, and fall
+back to the original PNG.
+"""
+import os
+import pathlib
+
+DERIVED_SUFFIX = "-derived"
+WIDTHS = (320, 640, 1280)
+# Extension to MIME type, in order of preference
+FORMATS = {"avif": "image/avif", "webp": "image/webp"}
+
+
+def derived_dir(root: pathlib.Path, directory: str) -> pathlib.Path:
+    return root / f"{directory}{DERIVED_SUFFIX}"
+
+
+def filename(id: str, width: int, ext: str) -> str:
+    return f"{id}-{width}.{ext}"
+
+
+def scan(root: pathlib.Path, directory: str) -> dict[str, list[tuple[int, str]]]:
+    """Image id -> `(width, ext)` of the derivatives available, by increasing width."""
+    id2variants = {}
+    try:
+        with os.scandir(derived_dir(root, directory)) as it:
+            names = [e.name for e in it]
+    except FileNotFoundError:
+        return {}
+    for name in names:
+        stem, _, ext = name.rpartition(".")
+        id, _, width = stem.rpartition("-")
+        if ext in FORMATS and width.isdigit():
+            id2variants.setdefault(id, []).append((int(width), ext))
+    for variants in id2variants.values():
+        variants.sort()
+    return id2variants
+
+
+def choose(variants: list[tuple[int, str]], accept, width: int | None) -> tuple[int, str] | None:
+    """Pick a derivative for the request, or None to send the original.
+
+    `accept` is the request's `accept_mimetypes`. Without `width`, the largest derivative is used.
+    """
+    # Only explicitly listed types: clients sending `*/*` do not necessarily decode WebP
+    listed = {value for value, quality in accept if quality > 0}
+    accepted = [ext for ext, mimetype in FORMATS.items() if mimetype in listed]
+    candidates = [(w, ext) for w, ext in variants if ext in accepted]
+    if not candidates:
+        return None
+    widths = sorted({w for w, _ in candidates})
+    if width is None:
+        chosen_width = widths[-1]
+    else:
+        chosen_width = next((w for w in widths if w >= width), widths[-1])
+    return next((chosen_width, ext) for ext in accepted if (chosen_width, ext) in candidates)
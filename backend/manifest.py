@@ -0,0 +1,122 @@
+"""Precomputed index of the audio and image files available for each sentence.
+
+Globbing `audio/` and checking image existence on every request is the most
+expensive part of serving a sentence, so each language pair directory is listed
+once and summarized into a manifest (`manifest.json` in the pair's root).
+Build it offline with `python -m backend.tools.build_manifest`; otherwise it is
+built at startup whenever the file is missing or older than the assets.
+"""
+import dataclasses
+import json
+import os
+import pathlib
+
+MANIFEST_FILENAME = "manifest.json"
+
+
+@dataclasses.dataclass
+class SentenceAssets:
+    id_L1: str
+    id_L2: str
+    voices_L1: list[str]
+    voices_L2: list[str]
+    image_horizontal: bool
+    image_vertical: bool
+
+    @property
+    def complete(self) -> bool:
+        """Whether the sentence can be served, i.e. both sides have audio."""
+        return len(self.voices_L1) > 0 and len(self.voices_L2) > 0
+
+    @property
+    def audio_stems(self) -> list[str]:
+        """Audio files served for the sentence, without suffix: the first L1 voice, then every L2 voice."""
+        return [f"{self.id_L1}_{self.voices_L1[0]}", *[f"{self.id_L2}_{voice}" for voice in self.voices_L2]]
+
+    def to_dict(self) -> dict:
+        return {
+            "id_L1": self.id_L1,
+            "id_L2": self.id_L2,
+            "voices_L1": self.voices_L1,
+            "voices_L2": self.voices_L2,
+            "image_horizontal": self.image_horizontal,
+            "image_vertical": self.image_vertical,
+            "complete": self.complete,
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "SentenceAssets":
+        return cls(d["id_L1"], d["id_L2"], d["voices_L1"], d["voices_L2"], d["image_horizontal"], d["image_vertical"])
+
+
+def image_id(L1: str, L2: str, id_L1: str, id_L2: str) -> str:
+    """Images are generated from the English side of the pair."""
+    if L1 == "en":
+        return id_L1
+    if L2 == "en":
+        return id_L2
+    raise NotImplementedError(f"Unsupported language pair {L1} -> {L2} (Should include English).")
+
+
+def _list_stems(directory: pathlib.Path, suffix: str) -> list[str]:
+    try:
+        with os.scandir(directory) as it:
+            return [e.name[:-len(suffix)] for e in it if e.name.endswith(suffix)]
+    except FileNotFoundError:
+        return []
+
+
+def build(root: pathlib.Path, L1: str, L2: str, ids: list[tuple[str, str]]) -> dict[str, SentenceAssets]:
+    """Scan the asset directories of a language pair once.
+
+    `ids` is a list of `(id_L1, id_L2)` tuples, one per translated sentence.
+    Returns a mapping from `id_L2` to the assets of the sentence pair.
+    """
+    id2voices: dict[str, list[str]] = {}
+    for stem in sorted(_list_stems(root / "audio", ".mp3")):
+        id, _, voice = stem.partition("_")
+        id2voices.setdefault(id, []).append(voice)
+    images_horizontal = set(_list_stems(root / "image-horizontal", ".png"))
+    images_vertical = set(_list_stems(root / "image-vertical", ".png"))
+
+    id2assets = {}
+    for id_L1, id_L2 in ids:
+        id_image = image_id(L1, L2, id_L1, id_L2)
+        id2assets[id_L2] = SentenceAssets(
+            id_L1, id_L2,
+            id2voices.get(id_L1, []), id2voices.get(id_L2, []),
+            id_image in images_horizontal, id_image in images_vertical,
+        )
+    return id2assets
+
+
+def is_fresh(root: pathlib.Path) -> bool:
+    """Whether `manifest.json` is newer than every directory and file it summarizes."""
+    try:
+        mtime = (root / MANIFEST_FILENAME).stat().st_mtime
+    except FileNotFoundError:
+        return False
+    for p in [root / "audio", root / "image-horizontal", root / "image-vertical", *root.glob("translation_*.json")]:
+        try:
+            if p.stat().st_mtime > mtime:
+                return False
+        except FileNotFoundError:
+            continue
+    return True
+
+
+def save(root: pathlib.Path, id2assets: dict[str, SentenceAssets]) -> None:
+    tmp = root / f"{MANIFEST_FILENAME}.tmp"
+    tmp.write_text(json.dumps({k: v.to_dict() for k, v in id2assets.items()}))
+    tmp.replace(root / MANIFEST_FILENAME)
+
+
+def load(root: pathlib.Path) -> dict[str, SentenceAssets]:
+    d = json.loads((root / MANIFEST_FILENAME).read_text())
+    return {k: SentenceAssets.from_dict(v) for k, v in d.items()}
+
+
+def load_or_build(root: pathlib.Path, L1: str, L2: str, ids: list[tuple[str, str]]) -> dict[str, SentenceAssets]:
+    if is_fresh(root):
+        return load(root)
+    return build(root, L1, L2, ids)
@@ -0,0 +1,92 @@
+"""Minimal MPEG audio Layer III frame parsing, enough to validate, measure and join MP3 files.
+
+Shared by the backend tools and `tools/merge_audio.py`.
+"""
+import dataclasses
+
+# Layer III bitrates in kbps, MPEG-1 and MPEG-2/2.5
+_BITRATES = {
+    True: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    False: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+_SAMPLE_RATES = {3: [44100, 48000, 32000], 2: [22050, 24000, 16000], 0: [11025, 12000, 8000]}
+
+
+@dataclasses.dataclass
+class FrameHeader:
+    version_bits: int
+    sample_rate: int
+    channel_mode: int
+    length: int
+    samples: int
+
+    @property
+    def side_info(self) -> int:
+        if self.version_bits == 3:
+            return 17 if self.channel_mode == 3 else 32
+        return 9 if self.channel_mode == 3 else 17
+
+
+def parse_header(data: bytes, pos: int) -> FrameHeader | None:
+    """The Layer III frame header at `pos`, or None if there is none."""
+    if pos + 4 > len(data) or data[pos] != 0xFF or (data[pos + 1] & 0xE0) != 0xE0:
+        return None
+    b1, b2 = data[pos + 1], data[pos + 2]
+    version_bits = (b1 >> 3) & 0x3
+    bitrate_index, sample_rate_index = b2 >> 4, (b2 >> 2) & 0x3
+    if version_bits == 1 or ((b1 >> 1) & 0x3) != 1 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+    mpeg1 = version_bits == 3
+    sample_rate = _SAMPLE_RATES[version_bits][sample_rate_index]
+    length = (144 if mpeg1 else 72) * _BITRATES[mpeg1][bitrate_index] * 1000 // sample_rate + ((b2 >> 1) & 0x1)
+    return FrameHeader(version_bits, sample_rate, data[pos + 3] >> 6, length, 1152 if mpeg1 else 576)
+
+
+def read_frames(data: bytes) -> tuple[FrameHeader, list[bytes]]:
+    """Split an MP3 file into its audio frames, dropping ID3 tags and the Xing/Info/VBRI header frame.
+
+    Returns the header of the first frame and the frames. Raises ValueError if the file is not a
+    sequence of whole frames, e.g. when truncated.
+    """
+    pos = 0
+    if data[:3] == b"ID3":
+        if len(data) < 10:
+            raise ValueError("truncated ID3 tag")
+        size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+        pos = 10 + size + (10 if data[5] & 0x10 else 0)
+    first = None
+    frames = []
+    while pos < len(data):
+        if data[pos:pos + 3] == b"TAG" and len(data) - pos == 128:
+            break  # ID3v1
+        header = parse_header(data, pos)
+        if header is None:
+            raise ValueError(f"no MP3 frame header at byte {pos}")
+        if pos + header.length > len(data):
+            raise ValueError(f"truncated: last frame ends at byte {pos + header.length} of {len(data)}")
+        frame = data[pos:pos + header.length]
+        pos += header.length
+        if first is None:
+            first = header
+            tag = frame[4 + header.side_info:8 + header.side_info]
+            if tag in (b"Xing", b"Info") or frame[36:40] == b"VBRI":
+                continue
+        frames.append(frame)
+    if first is None:
+        raise ValueError("no MP3 frames")
+    return first, frames
+
+
+def silent_frames(header: FrameHeader, duration_ms: int) -> list[bytes]:
+    """Frames of digital silence matching `header`: lowest bitrate, all-zero side info and main data."""
+    mpeg1 = header.version_bits == 3
+    length = (144 if mpeg1 else 72) * _BITRATES[mpeg1][1] * 1000 // header.sample_rate
+    sample_rate_index = _SAMPLE_RATES[header.version_bits].index(header.sample_rate)
+    frame = bytes([
+        0xFF,
+        0xE0 | (header.version_bits << 3) | (1 << 1) | 1,  # Layer III, no CRC
+        (1 << 4) | (sample_rate_index << 2),
+        header.channel_mode << 6,
+    ]) + b"\0" * (length - 4)
+    n = round(duration_ms / 1000 * header.sample_rate / header.samples)
+    return [frame] * n
@@ -1,49 +1,233 @@
-import pathlib
-import json
+"""Language pairs in `assets/` and their data, loaded on first use.
+
+Loaded pairs are immutable snapshots. When the generation tools write new files,
+`refresh` (run periodically by `watch`) loads a new snapshot, reusing the parts
+whose files did not change, and publishes it by swapping it in; requests holding
+the previous snapshot keep reading it consistently.
+"""
+import array
+import collections
+import dataclasses
 import hashlib
+import itertools
+import logging
+import os
+import pathlib
+import threading
+import time
 
-langpair2root = {
-    "en": {
-        "hi": pathlib.Path("assets/en/hi"),
-        "ko": pathlib.Path("assets/en/ko"),
-        "ja": pathlib.Path("assets/en/ja"),
-        "ru": pathlib.Path("assets/en/ru"),
-    },
-    "ja": {
-        "en": pathlib.Path("assets/ja/en"),
-    }
-}
+import numpy as np
 
-# L1name -> L2name -> L2sentence -> L1sentence
-L1_2_L2_2sentences = {
-    l1: {
-        l2: json.loads((root / f"translation_{l1}.json").read_text())
-        for l2, root in l2_2_root.items()
-    }
-    for l1, l2_2_root in langpair2root.items()
-}
-L1_2_L2_2sentences_keys = {
-    l1: {
-        l2: sorted(L1_2_L2_2sentences[l1][l2].keys(), key=lambda x: (len(x), x))
-        for l2 in L1_2_L2_2sentences[l1]
-    }
-    for l1 in L1_2_L2_2sentences
-}
+from . import audio_sprites, audio_variants, difficulty, image_variants, manifest, search_index, sentence_store, word_index
+
+ASSETS_ROOT = pathlib.Path("assets")
+# Number of language pairs kept in memory; least recently used ones are evicted
+MAX_LOADED_PAIRS = int(os.environ.get("VOCAGEN_MAX_LOADED_PAIRS", 8))
 
-L1_2_L2_2words = {
-    l1: {
-        l2: sorted((root / 'llm').glob("*"))
-        for l2, root in l2_2_root.items()
-    }
-    for l1, l2_2_root in langpair2root.items()
-}
-L1_2_L2_2images = {
-    l1: {
-        l2: sorted((root / 'image-horizontal').glob(f"*.png")) + sorted((root / 'image-vertical').glob(f"*.png"))
-        for l2, root in l2_2_root.items()
-    }
-    for l1, l2_2_root in langpair2root.items()
-}
 
 def sentence2id(s):
     return hashlib.sha256(s.encode('utf8')).hexdigest()
+
+
+def discover(assets_root: pathlib.Path = ASSETS_ROOT) -> dict[str, dict[str, pathlib.Path]]:
+    """Find language pairs laid out as `assets/<L1>/<L2>` with translated sentences."""
+    langpair2root = {}
+    for root in sorted(assets_root.glob("*/*")):
+        l1, l2 = root.parent.name, root.name
+        if (root / f"translation_{l1}.json").exists() or (root / sentence_store.STORE_FILENAME).exists():
+            langpair2root.setdefault(l1, {})[l2] = root
+    return langpair2root
+
+
+# L1name -> L2name -> root directory of the pair
+langpair2root = discover()
+
+# Files of a pair, by the parts of `LanguagePair` derived from them. Directories change
+# when files are added to, replaced in (the tools write to a temporary file and rename) or removed from them.
+WATCHED = {
+    "sentences": ["translation_{L1}.json", sentence_store.STORE_FILENAME, "frequency.csv",
+                  difficulty.INDEX_FILENAME, search_index.INDEX_FILENAME],
+    "words": ["llm", word_index.INDEX_FILENAME],
+    "assets": [
+        manifest.MANIFEST_FILENAME, "audio", "image-horizontal", "image-vertical",
+        *(f"{d}{image_variants.DERIVED_SUFFIX}" for d in ["image-horizontal", "image-vertical"]),
+        *(v.directory for v in audio_variants.VARIANTS.values()),
+        f"{audio_sprites.DIRECTORY}/{audio_sprites.MANIFEST_FILENAME}",
+    ],
+}
+
+
+def _mtime_ns(path: pathlib.Path) -> int:
+    try:
+        return path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+
+def signature(root: pathlib.Path, l1: str) -> dict[str, tuple]:
+    """Group of `WATCHED` -> mtimes of its files."""
+    return {
+        group: tuple(_mtime_ns(root / name.format(L1=l1)) for name in names)
+        for group, names in WATCHED.items()
+    }
+
+
+@dataclasses.dataclass
+class LanguagePair:
+    L1: str
+    L2: str
+    root: pathlib.Path
+    # (L2sentence, L1sentence), memory-mapped
+    sentences: sentence_store.SentenceStore
+    # L2 sentence id -> assets of the sentence pair
+    id2assets: dict[str, manifest.SentenceAssets]
+    # Indices into the sentence store, in length order.
+    # Only sentences with all of their audio files are served.
+    sentences_keys: array.array
+    # Servable sentences sorted by length, number of words and rarest word
+    difficulty: difficulty.DifficultyIndex
+    # Words in rank order, with their sentences as indices into the sentence store
+    words: word_index.WordIndex
+    # Words of both languages -> sentences containing them
+    search: search_index.SearchIndex
+    # Indices into the word index, in rank order.
+    # Only words whose sentences are all servable are listed.
+    words_keys: array.array
+    # ids of sentences with horizontal / vertical image
+    images_horizontal: set[str]
+    images_vertical: set[str]
+    images: list[pathlib.Path]
+    # "image-horizontal" / "image-vertical" -> image id -> (width, ext) of the WebP/AVIF derivatives
+    image_derivatives: dict[str, dict[str, list[tuple[int, str]]]]
+    # Audio variant name -> stems (`<id>_<voice>`) transcoded into it
+    audio_variants: dict[str, set[str]]
+    # Sprite name -> stems and segments of the audio sprites
+    audio_sprites: dict[str, dict]
+    # mtimes of the watched files when the pair was loaded, see `signature`
+    signature: dict[str, tuple]
+    # Distinguishes loads of the pair, e.g. in cache keys
+    version: int = dataclasses.field(default_factory=itertools.count().__next__)
+
+    @classmethod
+    def load(cls, l1: str, l2: str, root: pathlib.Path,
+             previous: "LanguagePair | None" = None, changed: set[str] = frozenset(WATCHED)) -> "LanguagePair":
+        """Load the pair. Parts of `previous` are reused unless their group of files (see `WATCHED`) is in `changed`."""
+        current_signature = signature(root, l1)
+        translation_json = root / f"translation_{l1}.json"
+        reuse_sentences = previous is not None and "sentences" not in changed
+        reuse_words = reuse_sentences and "words" not in changed
+        store = previous.sentences if reuse_sentences else sentence_store.load_or_convert(root, translation_json)
+        id2assets = manifest.load_or_build(root, l1, l2, [(store.id_L1(i), store.id_L2(i)) for i in range(len(store))])
+
+        def is_complete(i: int) -> bool:
+            assets = id2assets.get(store.id_L2(i))
+            return assets is not None and assets.complete
+
+        sentences_keys = array.array('I', (i for i in range(len(store)) if is_complete(i)))
+        servable = set(sentences_keys)
+        words = previous.words if reuse_words else word_index.load_or_convert(root, translation_json, store)
+        servable_mask = np.zeros(len(store), dtype=bool)
+        servable_mask[np.frombuffer(sentences_keys, dtype=np.uint32)] = True
+        if reuse_sentences:
+            difficulty_arrays, search = previous.difficulty.arrays, previous.search
+        else:
+            difficulty_arrays = difficulty.load_or_convert(root, translation_json, store, l2)
+            search = search_index.load_or_convert(root, translation_json, store, l1, l2)
+
+        return cls(
+            l1, l2, root, store, id2assets, sentences_keys,
+            difficulty.DifficultyIndex(difficulty_arrays, servable_mask),
+            words,
+            search,
+            array.array('I', (i for i in range(len(words)) if all(j in servable for j in words.sentences(i)))),
+            {manifest.image_id(l1, l2, a.id_L1, a.id_L2) for a in id2assets.values() if a.image_horizontal},
+            {manifest.image_id(l1, l2, a.id_L1, a.id_L2) for a in id2assets.values() if a.image_vertical},
+            sorted((root / 'image-horizontal').glob(f"*.png")) + sorted((root / 'image-vertical').glob(f"*.png")),
+            {d: image_variants.scan(root, d) for d in ["image-horizontal", "image-vertical"]},
+            audio_variants.scan(root),
+            audio_sprites.load(root),
+            current_signature,
+        )
+
+
+# (L1, L2) -> latest snapshot, least recently used first
+_pairs: collections.OrderedDict[tuple[str, str], LanguagePair] = collections.OrderedDict()
+_pairs_lock = threading.Lock()
+# (L1, L2) -> lock held while loading the pair, so that it is not loaded twice at once
+_load_locks: dict[tuple[str, str], threading.Lock] = {}
+
+
+def _load_lock(l1: str, l2: str) -> threading.Lock:
+    with _pairs_lock:
+        return _load_locks.setdefault((l1, l2), threading.Lock())
+
+
+def _publish(l1: str, l2: str, pair: LanguagePair) -> None:
+    with _pairs_lock:
+        _pairs[l1, l2] = pair
+        _pairs.move_to_end((l1, l2))
+        while len(_pairs) > MAX_LOADED_PAIRS:
+            _pairs.popitem(last=False)
+
+
+def get(l1: str, l2: str) -> LanguagePair:
+    """Latest snapshot of the language pair, loaded on first use. Raises KeyError for unknown pairs."""
+    if l2 not in langpair2root.get(l1, {}):
+        raise KeyError(f"Unsupported language pair {l1} -> {l2}.")
+    with _pairs_lock:
+        pair = _pairs.get((l1, l2))
+        if pair is not None:
+            _pairs.move_to_end((l1, l2))
+            return pair
+    with _load_lock(l1, l2):
+        with _pairs_lock:
+            pair = _pairs.get((l1, l2))
+        if pair is None:
+            pair = LanguagePair.load(l1, l2, langpair2root[l1][l2])
+            _publish(l1, l2, pair)
+    return pair
+
+
+def refresh() -> None:
+    """Pick up new language pairs, and publish new snapshots of the loaded pairs whose files changed."""
+    global langpair2root
+    langpair2root = discover()
+    with _pairs_lock:
+        loaded = list(_pairs)
+    for l1, l2 in loaded:
+        if l2 not in langpair2root.get(l1, {}):
+            with _pairs_lock:
+                _pairs.pop((l1, l2), None)
+            continue
+        # Only this pair waits for its reload; other pairs are served and loaded meanwhile
+        with _load_lock(l1, l2):
+            with _pairs_lock:
+                pair = _pairs.get((l1, l2))
+            if pair is None:
+                continue  # Evicted meanwhile
+            current = signature(pair.root, l1)
+            changed = {group for group in WATCHED if current[group] != pair.signature[group]}
+            if not changed:
+                continue
+            start = time.monotonic()
+            new = LanguagePair.load(l1, l2, pair.root, pair, changed)
+            with _pairs_lock:
+                # Not evicted meanwhile
+                if (l1, l2) in _pairs:
+                    _pairs[l1, l2] = new
+            logging.info("Reloaded %s-%s (%s) in %.2f s.", l1, l2, ", ".join(sorted(changed)), time.monotonic() - start)
+
+
+def watch(interval: float) -> threading.Thread:
+    """Call `refresh` every `interval` seconds in a daemon thread."""
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                refresh()
+            except Exception:
+                logging.exception("Failed to reload the language pairs.")
+
+    thread = threading.Thread(target=run, name="resource_util.watch", daemon=True)
+    thread.start()
+    return thread
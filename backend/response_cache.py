@@ -0,0 +1,79 @@
+"""Serialized JSON fragments of responses, cached and spliced into responses as they are.
+
+A sentence is the same for every request as long as its language pair is not
+reloaded, so its camelCase JSON is built once and kept in a least recently used
+cache bounded by total size. Keys include the version of the pair, so entries of
+a reloaded pair (e.g. after the manifest changed) are never hit again and age out.
+"""
+import collections
+import json
+import os
+import threading
+
+import flask
+
+MAX_BYTES = int(os.environ.get("VOCAGEN_RESPONSE_CACHE_BYTES", 64 * 1024 * 1024))
+
+
+class RawJSON(bytes):
+    """Serialized JSON, inserted into `response` as is."""
+
+
+def dumps(obj) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), sort_keys=True).encode("utf8")
+
+
+def _serialize(obj) -> bytes:
+    if isinstance(obj, RawJSON):
+        return obj
+    if isinstance(obj, dict):
+        return b"{" + b",".join(dumps(k) + b":" + _serialize(v) for k, v in obj.items()) + b"}"
+    if isinstance(obj, list):
+        return b"[" + b",".join(_serialize(v) for v in obj) + b"]"
+    return dumps(obj)
+
+
+def response(obj) -> flask.Response:
+    """Like `flask.jsonify`, splicing in `RawJSON` values without re-serializing them."""
+    return flask.Response(_serialize(obj), mimetype="application/json")
+
+
+class FragmentCache:
+    """LRU cache of `RawJSON`, bounded by the sum of their sizes. Thread safe."""
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self._entries: collections.OrderedDict[tuple, RawJSON] = collections.OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, key: tuple) -> RawJSON | None:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: tuple, value: RawJSON) -> None:
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._entries[key] = value
+            self._size += len(value)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def size(self) -> int:
+        return self._size
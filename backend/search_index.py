@@ -0,0 +1,182 @@
+"""Inverted index from words to the sentences containing them, for searching both sides of a language pair.
+
+Terms are the words of the L2 and L1 sentences, or character bigrams (and single
+characters) for languages written without spaces, see `tokenizer.search_terms`.
+The index is a flat file (`search.bin` in the pair's root), memory-mapped like the
+sentence store. Postings are sentence store indices, ascending, delta-encoded as
+LEB128 varints; they are decoded with NumPy.
+
+Layout (little endian):
+    header            magic "VGSX", version (u32), n (u64)
+    term_offsets      (n + 1) x u64, into terms
+    posting_offsets   (n + 1) x u64, into postings
+    counts            n x u32, number of sentences per term
+    terms             utf-8 terms, sorted by their bytes
+    postings          varints
+
+A query matches the sentences containing all of its terms.
+"""
+import mmap
+import pathlib
+import struct
+
+import numpy as np
+
+from . import tokenizer
+from .sentence_store import SentenceStore, STORE_FILENAME
+
+INDEX_FILENAME = "search.bin"
+MAGIC = b"VGSX"
+VERSION = 1
+_HEADER = struct.Struct("<4sIQ")
+
+
+def _varints(values: list[int]) -> bytes:
+    """Deltas of the ascending `values`, as LEB128 varints."""
+    out = bytearray()
+    prev = 0
+    for v in values:
+        d = v - prev
+        prev = v
+        while d >= 0x80:
+            out.append((d & 0x7F) | 0x80)
+            d >>= 7
+        out.append(d)
+    return bytes(out)
+
+
+def _decode(buf: np.ndarray) -> np.ndarray:
+    """Inverse of `_varints`, vectorized."""
+    if len(buf) == 0:
+        return np.zeros(0, dtype=np.uint32)
+    ends = np.flatnonzero(buf < 0x80)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    group = np.repeat(np.arange(len(ends)), ends - starts + 1)
+    shifts = ((np.arange(len(buf)) - starts[group]) * 7).astype(np.uint64)
+    deltas = np.add.reduceat((buf & 0x7F).astype(np.uint64) << shifts, starts)
+    return np.cumsum(deltas).astype(np.uint32)
+
+
+def convert(store: SentenceStore, L1: str, L2: str) -> bytes:
+    term2sentences = {}
+    for i in range(len(store)):
+        terms = set()
+        for lang, s in [(L2, store.sentence_L2(i)), (L1, store.sentence_L1(i))]:
+            terms.update(tokenizer.search_terms(s, lang))
+            # Single characters too, so that one-character queries of unsegmented languages match
+            if lang in tokenizer.UNSEGMENTED_LANGUAGES:
+                terms.update(c for run in tokenizer.words(s) for c in run)
+        for term in terms:
+            term2sentences.setdefault(term.encode("utf8"), []).append(i)
+    terms = sorted(term2sentences)
+    n = len(terms)
+    postings = [_varints(term2sentences[t]) for t in terms]
+
+    def offsets(parts: list[bytes]) -> bytes:
+        res = [0]
+        for b in parts:
+            res.append(res[-1] + len(b))
+        return struct.pack(f"<{n + 1}Q", *res)
+
+    return b"".join([
+        _HEADER.pack(MAGIC, VERSION, n),
+        offsets(terms),
+        offsets(postings),
+        struct.pack(f"<{n}I", *(len(term2sentences[t]) for t in terms)),
+        *terms,
+        *postings,
+    ])
+
+
+class SearchIndex:
+    """Read-only view of a converted search index."""
+
+    def __init__(self, buffer) -> None:
+        self._buffer = buffer
+        view = memoryview(buffer)
+        magic, version, n = _HEADER.unpack_from(view, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"Not a search index (version {VERSION}).")
+        self._n = n
+        pos = _HEADER.size
+        self._term_offsets = view[pos:pos + 8 * (n + 1)].cast("Q")
+        pos += 8 * (n + 1)
+        self._posting_offsets = view[pos:pos + 8 * (n + 1)].cast("Q")
+        pos += 8 * (n + 1)
+        self._counts = view[pos:pos + 4 * n].cast("I")
+        pos += 4 * n
+        self._terms = view[pos:pos + self._term_offsets[n]]
+        pos += self._term_offsets[n]
+        self._postings = np.frombuffer(buffer, dtype=np.uint8, count=self._posting_offsets[n], offset=pos)
+
+    @classmethod
+    def open(cls, path: pathlib.Path) -> "SearchIndex":
+        with path.open("rb") as f:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def __len__(self) -> int:
+        return self._n
+
+    def _term(self, i: int) -> bytes:
+        return bytes(self._terms[self._term_offsets[i]:self._term_offsets[i + 1]])
+
+    def _find(self, term: str) -> int | None:
+        key = term.encode("utf8")
+        lo, hi = 0, self._n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo if lo < self._n and self._term(lo) == key else None
+
+    def _sentences(self, i: int) -> np.ndarray:
+        """Sentence store indices containing the `i`th term, ascending."""
+        return _decode(self._postings[self._posting_offsets[i]:self._posting_offsets[i + 1]])
+
+    def _intersect(self, terms: list[str]) -> np.ndarray:
+        found = [self._find(t) for t in terms]
+        if not found or None in found:
+            return np.zeros(0, dtype=np.uint32)
+        # From the rarest term, so that the candidates shrink fast
+        found.sort(key=lambda i: self._counts[i])
+        result = None
+        for i in found:
+            sentences = self._sentences(i)
+            result = sentences if result is None else np.intersect1d(result, sentences, assume_unique=True)
+            if len(result) == 0:
+                break
+        return result
+
+    def search(self, query: str, L1: str, L2: str) -> np.ndarray:
+        """Sentence store indices containing every term of `query`, tokenized as L2 or as L1, ascending."""
+        tokenizations = {tuple(tokenizer.search_terms(query, lang)) for lang in (L2, L1)}
+        results = [self._intersect(list(terms)) for terms in tokenizations]
+        return results[0] if len(results) == 1 else np.union1d(*results)
+
+
+def _mtime(path: pathlib.Path) -> float:
+    try:
+        return path.stat().st_mtime
+    except FileNotFoundError:
+        return 0
+
+
+def is_fresh(root: pathlib.Path, translation_json: pathlib.Path) -> bool:
+    """Whether `search.bin` is newer than the sentences."""
+    mtime = _mtime(root / INDEX_FILENAME)
+    return mtime != 0 and max(_mtime(root / STORE_FILENAME), _mtime(translation_json)) <= mtime
+
+
+def save(root: pathlib.Path, store: SentenceStore, L1: str, L2: str) -> None:
+    tmp = root / f"{INDEX_FILENAME}.tmp"
+    tmp.write_bytes(convert(store, L1, L2))
+    tmp.replace(root / INDEX_FILENAME)
+
+
+def load_or_convert(root: pathlib.Path, translation_json: pathlib.Path, store: SentenceStore, L1: str, L2: str) -> SearchIndex:
+    """Memory-map `search.bin`, or build the index in memory if it is missing or outdated."""
+    if is_fresh(root, translation_json):
+        return SearchIndex.open(root / INDEX_FILENAME)
+    return SearchIndex(convert(store, L1, L2))
@@ -0,0 +1,158 @@
+"""Compact on-disk store of translated sentence pairs.
+
+Keeping `translation_<L1>.json` as Python dicts costs hundreds of bytes per
+sentence in every worker. Instead, the pairs are converted once into a flat
+file (`sentences.bin` in the pair's root) which is memory-mapped, so the pages
+are shared between workers and strings are decoded only when requested.
+
+Layout (little endian):
+    header       magic "VGSS", version (u32), n (u64)
+    offsets_L2   (n + 1) x u64, into blob_L2
+    offsets_L1   (n + 1) x u64, into blob_L1
+    digests_L2   n x 32 bytes, sha256 of the L2 sentences
+    digests_L1   n x 32 bytes, sha256 of the L1 sentences
+    by_digest    n x u32, indices sorted by digests_L2 (for lookups by sentence)
+    padding      to 8 bytes
+    blob_L2      utf-8 L2 sentences
+    blob_L1      utf-8 L1 sentences
+
+Sentences are sorted by `(len(s_L2), s_L2)`, so index order is length order.
+"""
+import hashlib
+import json
+import mmap
+import pathlib
+import struct
+from typing import Iterator
+
+STORE_FILENAME = "sentences.bin"
+MAGIC = b"VGSS"
+VERSION = 1
+_HEADER = struct.Struct("<4sIQ")
+
+
+def convert(sentences: dict[str, str]) -> bytes:
+    """Serialize a L2 sentence -> L1 sentence mapping."""
+    keys = sorted(sentences.keys(), key=lambda x: (len(x), x))
+    n = len(keys)
+    encoded_L2 = [s.encode('utf8') for s in keys]
+    encoded_L1 = [sentences[s].encode('utf8') for s in keys]
+    digests_L2 = [hashlib.sha256(b).digest() for b in encoded_L2]
+    digests_L1 = [hashlib.sha256(b).digest() for b in encoded_L1]
+    by_digest = sorted(range(n), key=lambda i: digests_L2[i])
+
+    def offsets(encoded: list[bytes]) -> bytes:
+        res = [0]
+        for b in encoded:
+            res.append(res[-1] + len(b))
+        return struct.pack(f"<{n + 1}Q", *res)
+
+    parts = [
+        _HEADER.pack(MAGIC, VERSION, n),
+        offsets(encoded_L2),
+        offsets(encoded_L1),
+        b"".join(digests_L2),
+        b"".join(digests_L1),
+        struct.pack(f"<{n}I", *by_digest),
+    ]
+    size = sum(len(p) for p in parts)
+    parts.append(b"\0" * (-size % 8))
+    parts += encoded_L2 + encoded_L1
+    return b"".join(parts)
+
+
+class SentenceStore:
+    """Read-only view of a converted sentence file, indexed in length order."""
+
+    def __init__(self, buffer) -> None:
+        self._buffer = buffer
+        view = memoryview(buffer)
+        magic, version, n = _HEADER.unpack_from(view, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"Not a sentence store (version {VERSION}).")
+        self._n = n
+        pos = _HEADER.size
+        self._offsets_L2 = view[pos:pos + 8 * (n + 1)].cast("Q")
+        pos += 8 * (n + 1)
+        self._offsets_L1 = view[pos:pos + 8 * (n + 1)].cast("Q")
+        pos += 8 * (n + 1)
+        self._digests_L2 = view[pos:pos + 32 * n]
+        pos += 32 * n
+        self._digests_L1 = view[pos:pos + 32 * n]
+        pos += 32 * n
+        self._by_digest = view[pos:pos + 4 * n].cast("I")
+        pos += 4 * n
+        pos += -pos % 8
+        self._blob_L2 = view[pos:pos + self._offsets_L2[n]]
+        pos += self._offsets_L2[n]
+        self._blob_L1 = view[pos:pos + self._offsets_L1[n]]
+
+    @classmethod
+    def open(cls, path: pathlib.Path) -> "SentenceStore":
+        with path.open("rb") as f:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def __len__(self) -> int:
+        return self._n
+
+    def sentence_L2(self, i: int) -> str:
+        return str(self._blob_L2[self._offsets_L2[i]:self._offsets_L2[i + 1]], 'utf8')
+
+    def sentence_L1(self, i: int) -> str:
+        return str(self._blob_L1[self._offsets_L1[i]:self._offsets_L1[i + 1]], 'utf8')
+
+    def id_L2(self, i: int) -> str:
+        return self._digest_L2(i).hex()
+
+    def id_L1(self, i: int) -> str:
+        return self._digests_L1[32 * i:32 * (i + 1)].hex()
+
+    def _digest_L2(self, i: int) -> bytes:
+        return bytes(self._digests_L2[32 * i:32 * (i + 1)])
+
+    def find(self, s_L2: str) -> int:
+        """Index of a L2 sentence. Raises KeyError if it is not in the store."""
+        digest = hashlib.sha256(s_L2.encode('utf8')).digest()
+        lo, hi = 0, self._n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            i = self._by_digest[mid]
+            if self._digest_L2(i) < digest:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self._n:
+            i = self._by_digest[lo]
+            if self._digest_L2(i) == digest:
+                return i
+        raise KeyError(s_L2)
+
+    def __contains__(self, s_L2: str) -> bool:
+        try:
+            self.find(s_L2)
+        except KeyError:
+            return False
+        return True
+
+    def items(self) -> Iterator[tuple[str, str]]:
+        """Yield `(L2 sentence, L1 sentence)` in length order, like the translation json."""
+        for i in range(self._n):
+            yield self.sentence_L2(i), self.sentence_L1(i)
+
+
+def save(translation_json: pathlib.Path, save_to: pathlib.Path) -> None:
+    tmp = save_to.with_name(f"{save_to.name}.tmp")
+    tmp.write_bytes(convert(json.loads(translation_json.read_text(encoding="utf-8"))))
+    tmp.replace(save_to)
+
+
+def load_or_convert(root: pathlib.Path, translation_json: pathlib.Path) -> SentenceStore:
+    """Memory-map `sentences.bin`, or convert the json in memory if it is missing or outdated."""
+    path = root / STORE_FILENAME
+    try:
+        json_mtime = translation_json.stat().st_mtime
+    except FileNotFoundError:
+        json_mtime = None  # Deployed without the json
+    if path.exists() and (json_mtime is None or path.stat().st_mtime >= json_mtime):
+        return SentenceStore.open(path)
+    return SentenceStore(convert(json.loads(translation_json.read_text(encoding="utf-8"))))
@@ -0,0 +1,30 @@
+"""Splitting sentences into words, for the difficulty and search indices."""
+import unicodedata
+
+# Written without spaces between words
+UNSEGMENTED_LANGUAGES = {"ja", "zh", "th"}
+
+
+def words(text: str) -> list[str]:
+    """Lowercased runs of letters, marks and digits.
+
+    Punctuation (including the danda) and spaces separate words; combining marks
+    such as Devanagari vowel signs stay inside them. Runs of unsegmented languages
+    are whole phrases.
+    """
+    return "".join(c if unicodedata.category(c)[0] in "LMN" else " " for c in text.lower()).split()
+
+
+def ngrams(run: str, n: int) -> list[str]:
+    """Overlapping character n-grams of `run`, or `run` itself if it is shorter than `n`."""
+    if len(run) <= n:
+        return [run]
+    return [run[i:i + n] for i in range(len(run) - n + 1)]
+
+
+def search_terms(text: str, lang: str) -> list[str]:
+    """Terms of a text in the search index, without duplicates: words, or character bigrams of unsegmented languages."""
+    runs = words(unicodedata.normalize("NFKC", text))
+    if lang not in UNSEGMENTED_LANGUAGES:
+        return list(dict.fromkeys(runs))
+    return list(dict.fromkeys(gram for run in runs for gram in ngrams(run, 2)))
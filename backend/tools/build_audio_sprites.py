@@ -0,0 +1,92 @@
+"""Pack the audio files of every servable sentence into one sprite per sentence, see `backend.audio_sprites`.
+
+The MP3 frames of the files are concatenated as they are, without re-encoding, and the byte and time
+offsets of each file are recorded in the manifest. Sprites newer than their files are skipped, so reruns
+only process new sentences; sprites no sentence refers to any more are removed.
+"""
+import argparse
+import concurrent.futures
+import os
+import pathlib
+
+from .. import audio_sprites, mp3, resource_util
+
+
+def build(srcs: list[pathlib.Path], dst: pathlib.Path) -> list[list[int]]:
+    """Concatenate the frames of `srcs` into `dst`. Returns [byte_start, byte_end, ms_start, ms_end] per file."""
+    segments = []
+    chunks = []
+    n_bytes = n_samples = 0
+    sample_rate = None
+    for src in srcs:
+        header, frames = mp3.read_frames(src.read_bytes())
+        if sample_rate is None:
+            sample_rate = header.sample_rate
+        elif header.sample_rate != sample_rate:
+            raise ValueError(f"{src.name} is at {header.sample_rate} Hz, the other files at {sample_rate} Hz")
+        size = sum(map(len, frames))
+        samples = len(frames) * header.samples
+        segments.append([
+            n_bytes, n_bytes + size,
+            n_samples * 1000 // sample_rate, (n_samples + samples) * 1000 // sample_rate,
+        ])
+        chunks.extend(frames)
+        n_bytes += size
+        n_samples += samples
+    tmp = dst.with_name(f".{dst.name}.tmp")
+    tmp.write_bytes(b"".join(chunks))
+    os.replace(tmp, dst)
+    return segments
+
+
+def is_up_to_date(srcs: list[pathlib.Path], dst: pathlib.Path) -> bool:
+    try:
+        mtime = dst.stat().st_mtime
+    except FileNotFoundError:
+        return False
+    return all(src.stat().st_mtime <= mtime for src in srcs)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    n_built = n_failed = 0
+    with concurrent.futures.ProcessPoolExecutor(args.workers) as executor:
+        for L1, L2_2_root in resource_util.langpair2root.items():
+            for L2, root in L2_2_root.items():
+                pair = resource_util.get(L1, L2)
+                directory = root / audio_sprites.DIRECTORY
+                directory.mkdir(exist_ok=True)
+                previous = audio_sprites.load(root)
+                sprites = {}
+                futures = {}
+                for assets in pair.id2assets.values():
+                    if not assets.complete:
+                        continue
+                    stems = assets.audio_stems
+                    name = audio_sprites.sprite_name(stems)
+                    srcs = [root / "audio" / f"{stem}.mp3" for stem in stems]
+                    dst = directory / audio_sprites.filename(stems)
+                    if name in previous and is_up_to_date(srcs, dst):
+                        sprites[name] = previous[name]
+                    else:
+                        futures[executor.submit(build, srcs, dst)] = (name, stems)
+                for future in concurrent.futures.as_completed(futures):
+                    name, stems = futures[future]
+                    try:
+                        sprites[name] = {"stems": stems, "segments": future.result()}
+                        n_built += 1
+                    except (ValueError, OSError) as e:
+                        print(f"Failed to build the sprite of {stems[-1]}: {e}")
+                        n_failed += 1
+                audio_sprites.save(root, sprites)
+                for path in directory.glob("*.mp3"):
+                    if path.stem not in sprites:
+                        path.unlink()
+    print(f"Built {n_built} sprites, {n_failed} failed.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Write WebP (and optionally AVIF) images at several widths for every language pair. Requires Pillow.
+
+Images whose derivatives are newer than the PNG are skipped, so reruns only process new images.
+"""
+import argparse
+import concurrent.futures
+import os
+import pathlib
+
+from .. import image_variants, resource_util
+
+QUALITY = {"webp": 80, "avif": 60}
+
+
+def is_up_to_date(src: pathlib.Path, dst_dir: pathlib.Path, widths: list[int], formats: list[str]) -> bool:
+    mtime = src.stat().st_mtime
+    for width in widths:
+        for ext in formats:
+            try:
+                if (dst_dir / image_variants.filename(src.stem, width, ext)).stat().st_mtime < mtime:
+                    return False
+            except FileNotFoundError:
+                return False
+    return True
+
+
+def derive(src: pathlib.Path, dst_dir: pathlib.Path, widths: list[int], formats: list[str]) -> None:
+    """Resize and encode one image. Never upscales: widths above the original's are encoded at the original size."""
+    from PIL import Image
+
+    with Image.open(src) as im:
+        im.load()
+        for width in widths:
+            if width < im.width:
+                resized = im.resize((width, round(im.height * width / im.width)), Image.LANCZOS)
+            else:
+                resized = im
+            for ext in formats:
+                save_to = dst_dir / image_variants.filename(src.stem, width, ext)
+                tmp = save_to.with_name(f".{save_to.name}.tmp")
+                resized.save(tmp, format=ext.upper(), quality=QUALITY[ext])
+                os.replace(tmp, save_to)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--widths", type=int, nargs="+", default=list(image_variants.WIDTHS))
+    parser.add_argument("--avif", action="store_true", help="Also write AVIF, which is smaller but slow to encode")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+    formats = ["webp", "avif"] if args.avif else ["webp"]
+
+    jobs = []
+    for L1, L2_2_root in resource_util.langpair2root.items():
+        for L2, root in L2_2_root.items():
+            for directory in ["image-horizontal", "image-vertical"]:
+                dst_dir = image_variants.derived_dir(root, directory)
+                dst_dir.mkdir(exist_ok=True)
+                for src in sorted((root / directory).glob("*.png")):
+                    if not is_up_to_date(src, dst_dir, args.widths, formats):
+                        jobs.append((src, dst_dir))
+
+    n_failed = 0
+    with concurrent.futures.ProcessPoolExecutor(args.workers) as executor:
+        futures = {executor.submit(derive, src, dst_dir, args.widths, formats): src for src, dst_dir in jobs}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Failed to convert {futures[future]}: {e}")
+                n_failed += 1
+    print(f"Converted {len(jobs) - n_failed} images, {n_failed} failed.")
+
+
+if __name__ == '__main__':
+    main()
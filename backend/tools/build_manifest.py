@@ -0,0 +1,16 @@
+"""Write `manifest.json` for every language pair, so that the backend does not scan the asset directories."""
+from .. import manifest, resource_util, sentence_store
+
+
+def main():
+    for L1, L2_2_root in resource_util.langpair2root.items():
+        for L2, root in L2_2_root.items():
+            store = sentence_store.load_or_convert(root, root / f"translation_{L1}.json")
+            id2assets = manifest.build(root, L1, L2, [(store.id_L1(i), store.id_L2(i)) for i in range(len(store))])
+            manifest.save(root, id2assets)
+            n_complete = sum(a.complete for a in id2assets.values())
+            print(f"{L1}-{L2}: {n_complete} / {len(id2assets)} sentences complete")
+
+
+if __name__ == '__main__':
+    main()
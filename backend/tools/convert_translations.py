@@ -0,0 +1,24 @@
+"""Convert `translation_<L1>.json` and `llm/` of every language pair into memory-mappable `sentences.bin`, `words.bin`
+and `search.bin`, and compute the difficulty of the sentences into `difficulty.npz`."""
+from .. import difficulty, resource_util, search_index, sentence_store, word_index
+
+
+def main():
+    for L1, L2_2_root in resource_util.langpair2root.items():
+        for L2, root in L2_2_root.items():
+            translation_json = root / f"translation_{L1}.json"
+            if translation_json.exists():
+                sentence_store.save(translation_json, root / sentence_store.STORE_FILENAME)
+            else:
+                print(f"{L1}-{L2}: no {translation_json.name}, using the existing {sentence_store.STORE_FILENAME}")
+            store = sentence_store.SentenceStore.open(root / sentence_store.STORE_FILENAME)
+            word_index.save(root, store)
+            words = word_index.WordIndex.open(root / word_index.INDEX_FILENAME)
+            difficulty.save(root, store, L2)
+            search_index.save(root, store, L1, L2)
+            search = search_index.SearchIndex.open(root / search_index.INDEX_FILENAME)
+            print(f"{L1}-{L2}: {len(store)} sentences, {len(words)} words, {len(search)} search terms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+"""Migrate `userdb/credentials.txt` and `userdb/*.json` into the SQLite user database."""
+import argparse
+import json
+import pathlib
+
+from .. import dbutils
+from ..types import Statistics
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("userdb", type=pathlib.Path, nargs="?", default=pathlib.Path("userdb"))
+    args = parser.parse_args()
+
+    conn = dbutils._connect()
+    with conn:
+        n_users = 0
+        try:
+            text = (args.userdb / "credentials.txt").read_text()
+        except FileNotFoundError:
+            text = ""
+        for l in text.splitlines():
+            if l == "":
+                continue
+            uid, password = l.split(",")
+            conn.execute("INSERT OR REPLACE INTO credentials (email, password) VALUES (?, ?)", (uid, password))
+            n_users += 1
+
+        n_statistics = 0
+        for p in sorted(args.userdb.glob("*.json")):
+            stat = Statistics.from_dict(json.loads(p.read_text()))
+            email = stat.email
+            # Replace rather than add, so that the migration can be re-run
+            conn.execute("DELETE FROM statistics WHERE email = ?", (email,))
+            conn.execute("DELETE FROM language_pair_statistics WHERE email = ?", (email,))
+            conn.execute("DELETE FROM achievements WHERE email = ?", (email,))
+            dbutils._write_user_statistics(conn, email, stat.to_dict())
+            conn.executemany("INSERT OR IGNORE INTO achievements (email, achievement) VALUES (?, ?)",
+                             [(email, a) for a in stat.achievements])
+            n_statistics += 1
+    print(f"Migrated {n_users} users and {n_statistics} statistics into {dbutils.DB_PATH}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,56 +1,160 @@
-"""Check availability of resources required for the backend."""
-from .. import resource_util
+"""Check the assets the backend serves: missing, orphaned and corrupt files per language pair.
+
+Files are hashed and validated in a process pool (MP3 frame headers, PNG
+signature and IEND chunk, so that truncated downloads are caught). The
+results are kept in `integrity.json` in each pair's root, keyed by path with
+size and mtime, so that later runs only revisit the files that changed.
+
+Prints a JSON report, one object per pair, and exits with 1 if a file is corrupt.
+
+    python -m backend.tools.resource_check [--output report.json] [--workers N] [--full]
+"""
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import os
+import pathlib
+import sys
+
+from .. import manifest, mp3, resource_util, sentence_store
+
+INTEGRITY_FILENAME = "integrity.json"
+# (directory, suffix) of the assets served by the backend
+ASSET_DIRS = [("audio", ".mp3"), ("image-horizontal", ".png"), ("image-vertical", ".png")]
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+PNG_IEND = b"\x00\x00\x00\x00IEND\xaeB`\x82"
+
+
+def validate_mp3(data: bytes) -> str | None:
+    """Walk the MP3 frames. Returns the problem, or None if the file is sound."""
+    try:
+        mp3.read_frames(data)
+    except ValueError as e:
+        return str(e)
+    return None
+
+
+def validate_png(data: bytes) -> str | None:
+    if not data.startswith(PNG_SIGNATURE):
+        return "no PNG signature"
+    if not data.endswith(PNG_IEND):
+        return "truncated: no IEND chunk at the end"
+    return None
+
+
+def check_file(path: str) -> tuple[str, str | None]:
+    """sha256 and the problem of a file, if any. Run in worker processes."""
+    data = pathlib.Path(path).read_bytes()
+    validate = validate_mp3 if path.endswith(".mp3") else validate_png
+    return hashlib.sha256(data).hexdigest(), validate(data)
+
+
+def _list(directory: pathlib.Path, suffix: str) -> dict[str, os.stat_result]:
+    try:
+        with os.scandir(directory) as it:
+            return {e.name: e.stat() for e in it if e.name.endswith(suffix) and e.is_file()}
+    except FileNotFoundError:
+        return {}
+
+
+def load_integrity(root: pathlib.Path) -> dict[str, list]:
+    """Relative path -> [size, mtime_ns, sha256, problem] of the previous run."""
+    try:
+        return json.loads((root / INTEGRITY_FILENAME).read_text())
+    except (FileNotFoundError, json.decoder.JSONDecodeError):
+        return {}
+
+
+def save_integrity(root: pathlib.Path, integrity: dict[str, list]) -> None:
+    tmp = root / f"{INTEGRITY_FILENAME}.tmp"
+    tmp.write_text(json.dumps(integrity))
+    tmp.replace(root / INTEGRITY_FILENAME)
+
+
+def scan(root: pathlib.Path, executor: concurrent.futures.Executor, full: bool = False) -> tuple[dict[str, list], int]:
+    """Validate the files of a pair that changed since the last run. Returns the integrity records and the number of files checked."""
+    previous = {} if full else load_integrity(root)
+    integrity = {}
+    futures = {}
+    for directory, suffix in ASSET_DIRS:
+        for name, st in _list(root / directory, suffix).items():
+            rel = f"{directory}/{name}"
+            record = previous.get(rel)
+            if record is not None and record[0] == st.st_size and record[1] == st.st_mtime_ns:
+                integrity[rel] = record
+            else:
+                futures[executor.submit(check_file, str(root / rel))] = (rel, st)
+    for future in concurrent.futures.as_completed(futures):
+        rel, st = futures[future]
+        digest, problem = future.result()
+        integrity[rel] = [st.st_size, st.st_mtime_ns, digest, problem]
+    save_integrity(root, integrity)
+    return integrity, len(futures)
+
+
+def report(L1: str, L2: str, root: pathlib.Path, integrity: dict[str, list], n_checked: int) -> dict:
+    store = sentence_store.load_or_convert(root, root / f"translation_{L1}.json")
+    ids_L1 = {store.id_L1(i) for i in range(len(store))}
+    ids_L2 = {store.id_L2(i) for i in range(len(store))}
+    ids_image = {manifest.image_id(L1, L2, store.id_L1(i), store.id_L2(i)) for i in range(len(store))}
+
+    dir2ids = {directory: set() for directory, _ in ASSET_DIRS}
+    orphan = {directory: [] for directory, _ in ASSET_DIRS}
+    for rel in sorted(integrity):
+        directory, _, name = rel.partition("/")
+        id = name.rpartition(".")[0].partition("_")[0]
+        dir2ids[directory].add(id)
+        known = (ids_L1 | ids_L2) if directory == "audio" else ids_image
+        if id not in known:
+            orphan[directory].append(rel)
+
+    return {
+        "L1": L1,
+        "L2": L2,
+        "n_sentences": len(store),
+        "n_files": len(integrity),
+        "n_checked": n_checked,
+        "missing": {
+            "audio_L1": sorted(ids_L1 - dir2ids["audio"]),
+            "audio_L2": sorted(ids_L2 - dir2ids["audio"]),
+            "image-horizontal": sorted(ids_image - dir2ids["image-horizontal"]),
+            "image-vertical": sorted(ids_image - dir2ids["image-vertical"]),
+        },
+        "orphan": orphan,
+        "corrupt": [{"path": rel, "problem": r[3]} for rel, r in sorted(integrity.items()) if r[3] is not None],
+    }
 
 
 def main():
-    for L1, L2_2_sentences in resource_util.L1_2_L2_2sentences.items():
-        for L2, sentences in L2_2_sentences.items():
-            check_resource(L1, L2, sentences)
-
-
-def check_resource(L1, L2, sentences):
-    root = resource_util.langpair2root[L1][L2]
-    n_image_exists = 0
-    n_image_watercolor_exists = 0
-    n = 0
-    
-    ids_L1 = set()
-    ids_L2 = set()
-    for s_L2, s_L1 in sentences.items():
-        id_L1 = resource_util.sentence2id(s_L1)
-        id_L2 = resource_util.sentence2id(s_L2)
-
-        ids_L1.add(id_L1)
-        ids_L2.add(id_L2)
-
-    if L1 == "en":
-        ids = ids_L1
-    elif L2 == "en":
-        ids = ids_L2
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output", type=pathlib.Path, help="Write the report here instead of stdout")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--full", action="store_true", help="Revisit every file, ignoring integrity.json")
+    args = parser.parse_args()
+
+    reports = []
+    with concurrent.futures.ProcessPoolExecutor(args.workers) as executor:
+        for L1, L2_2_root in resource_util.langpair2root.items():
+            for L2, root in L2_2_root.items():
+                integrity, n_checked = scan(root, executor, args.full)
+                reports.append(report(L1, L2, root, integrity, n_checked))
+
+    text = json.dumps(reports, indent=2)
+    if args.output is None:
+        print(text)
     else:
-        raise NotImplementedError(f"Unsupported language pair {L1} -> {L2} (Should include English).")
-
-    images = set(p.stem for p in (root / "image").glob("*.png"))
-    images_vertical = set(p.stem for p in (root / "image_watercolor").glob("*.png"))
-    audios = set(p.stem.split("_")[0] for p in (root / "audio").glob("*.mp3"))
-
-    print("#" * 80)
-    print("L1:", L1)
-    print("L2:", L2)
-    print("n_sentence_L1:", len(ids_L1))
-    print("n_sentence_L2:", len(ids_L2))
-    print("n_image_horizontal:",         len(images))
-    print("n_image_horizontal_known:",   len(ids & images))
-    print("n_image_horizontal_missing:", len(ids - images))
-    print("n_image_horizontal_orphan:",  len(images - ids))
-    print("n_image_vertical:",           len(ids & images_vertical))
-    print("n_image_vertical_missing:",   len(ids - images_vertical))
-    print("n_image_vertical_orphan:",    len(images_vertical - ids))
-    print("n_audio:", len(audios))
-    print("n_audio_L1:", len(ids_L1 & audios))
-    print("n_audio_L1_missing:", len(ids_L1 - audios))
-    print("n_audio_L2:", len(ids_L2 & audios))
-    print("n_audio_L2_missing:", len(ids_L2 - audios))
+        args.output.write_text(text)
+    for r in reports:
+        print(
+            f"{r['L1']}-{r['L2']}: {r['n_files']} files ({r['n_checked']} checked), "
+            f"{sum(map(len, r['missing'].values()))} missing, {sum(map(len, r['orphan'].values()))} orphan, "
+            f"{len(r['corrupt'])} corrupt",
+            file=sys.stderr,
+        )
+    if any(r["corrupt"] for r in reports):
+        sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,62 @@
+"""Transcode the MP3s of every language pair into the compact variants of `backend.audio_variants`. Requires ffmpeg.
+
+Files whose variant is newer than the MP3 are skipped, so reruns only process new audio.
+"""
+import argparse
+import concurrent.futures
+import os
+import pathlib
+import subprocess
+
+from .. import audio_variants, resource_util
+
+
+def is_up_to_date(src: pathlib.Path, dst: pathlib.Path) -> bool:
+    try:
+        return dst.stat().st_mtime >= src.stat().st_mtime
+    except FileNotFoundError:
+        return False
+
+
+def transcode(src: pathlib.Path, dst: pathlib.Path, variant: audio_variants.Variant) -> None:
+    tmp = dst.with_name(f".{dst.name}.tmp")
+    subprocess.run(
+        ["ffmpeg", "-nostdin", "-loglevel", "error", "-y", "-i", str(src), "-map_metadata", "-1", *variant.ffmpeg_args, str(tmp)],
+        check=True, capture_output=True,
+    )
+    os.replace(tmp, dst)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--variants", nargs="+", choices=list(audio_variants.VARIANTS), default=list(audio_variants.VARIANTS))
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    jobs = []
+    for L1, L2_2_root in resource_util.langpair2root.items():
+        for L2, root in L2_2_root.items():
+            srcs = sorted((root / "audio").glob("*.mp3"))
+            for name in args.variants:
+                variant = audio_variants.VARIANTS[name]
+                (root / variant.directory).mkdir(exist_ok=True)
+                for src in srcs:
+                    dst = root / variant.directory / variant.filename(src.stem)
+                    if not is_up_to_date(src, dst):
+                        jobs.append((src, dst, variant))
+
+    n_failed = 0
+    # ffmpeg does the work, in its own process
+    with concurrent.futures.ThreadPoolExecutor(args.workers) as executor:
+        futures = {executor.submit(transcode, *job): job[1] for job in jobs}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                future.result()
+            except (subprocess.CalledProcessError, OSError) as e:
+                print(f"Failed to transcode {futures[future]}: {getattr(e, 'stderr', None) or e}")
+                n_failed += 1
+    print(f"Transcoded {len(jobs) - n_failed} files, {n_failed} failed.")
+
+
+if __name__ == '__main__':
+    main()
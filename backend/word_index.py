@@ -0,0 +1,154 @@
+"""Index of words and their example sentences, built from `llm/*.json`.
+
+Reading and parsing a `llm/` file on every word request is avoided by
+collecting all words of a language pair into a flat file (`words.bin` in the
+pair's root), memory-mapped like the sentence store. Sentences are referenced
+by their index in the sentence store.
+
+Layout (little endian):
+    header            magic "VGWI", version (u32), n (u64)
+    word_offsets      (n + 1) x u64, into blob
+    ranks             n x u32, frequency rank of the words
+    sentence_offsets  (n + 1) x u32, into sentences
+    sentences         u32 sentence store indices; MISSING if not translated
+    padding           to 8 bytes
+    blob              utf-8 words
+
+Words are sorted by rank.
+"""
+import json
+import logging
+import mmap
+import os
+import pathlib
+import struct
+
+from .sentence_store import SentenceStore, STORE_FILENAME
+
+INDEX_FILENAME = "words.bin"
+MAGIC = b"VGWI"
+VERSION = 1
+MISSING = 0xFFFFFFFF
+_HEADER = struct.Struct("<4sIQ")
+
+
+def _read_words(llm_root: pathlib.Path) -> list[tuple[int, str, list[str]]]:
+    words = []
+    for p in llm_root.glob("*.json"):
+        try:
+            rank = int(p.stem)
+        except ValueError:
+            logging.warning("Skipping %s, not named by rank.", p)
+            continue
+        d = json.loads(p.read_text(encoding="utf-8"))
+        words.append((rank, d['word'], d['sentences']))
+    return sorted(words)
+
+
+def convert(llm_root: pathlib.Path, store: SentenceStore) -> bytes:
+    """Serialize the words in `llm_root`, resolving sentences against `store`."""
+    words = _read_words(llm_root)
+    n = len(words)
+    ranks = [rank for rank, _, _ in words]
+    encoded = [word.encode('utf8') for _, word, _ in words]
+    sentences = []
+    sentence_offsets = [0]
+    for _, _, ss in words:
+        for s in ss:
+            try:
+                sentences.append(store.find(s))
+            except KeyError:
+                sentences.append(MISSING)
+        sentence_offsets.append(len(sentences))
+    word_offsets = [0]
+    for b in encoded:
+        word_offsets.append(word_offsets[-1] + len(b))
+
+    parts = [
+        _HEADER.pack(MAGIC, VERSION, n),
+        struct.pack(f"<{n + 1}Q", *word_offsets),
+        struct.pack(f"<{n}I", *ranks),
+        struct.pack(f"<{n + 1}I", *sentence_offsets),
+        struct.pack(f"<{len(sentences)}I", *sentences),
+    ]
+    size = sum(len(p) for p in parts)
+    parts.append(b"\0" * (-size % 8))
+    parts += encoded
+    return b"".join(parts)
+
+
+class WordIndex:
+    """Read-only view of a converted word index, in rank order."""
+
+    def __init__(self, buffer) -> None:
+        self._buffer = buffer
+        view = memoryview(buffer)
+        magic, version, n = _HEADER.unpack_from(view, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"Not a word index (version {VERSION}).")
+        self._n = n
+        pos = _HEADER.size
+        self._word_offsets = view[pos:pos + 8 * (n + 1)].cast("Q")
+        pos += 8 * (n + 1)
+        self._ranks = view[pos:pos + 4 * n].cast("I")
+        pos += 4 * n
+        self._sentence_offsets = view[pos:pos + 4 * (n + 1)].cast("I")
+        pos += 4 * (n + 1)
+        n_sentences = self._sentence_offsets[n]
+        self._sentences = view[pos:pos + 4 * n_sentences].cast("I")
+        pos += 4 * n_sentences
+        pos += -pos % 8
+        self._blob = view[pos:pos + self._word_offsets[n]]
+
+    @classmethod
+    def open(cls, path: pathlib.Path) -> "WordIndex":
+        with path.open("rb") as f:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def __len__(self) -> int:
+        return self._n
+
+    def word(self, i: int) -> str:
+        return str(self._blob[self._word_offsets[i]:self._word_offsets[i + 1]], 'utf8')
+
+    def rank(self, i: int) -> int:
+        return self._ranks[i]
+
+    def sentences(self, i: int) -> list[int]:
+        """Sentence store indices of the example sentences. `MISSING` if not translated."""
+        return self._sentences[self._sentence_offsets[i]:self._sentence_offsets[i + 1]].tolist()
+
+
+def _mtime(path: pathlib.Path) -> float:
+    try:
+        return path.stat().st_mtime
+    except FileNotFoundError:
+        return 0
+
+
+def is_fresh(root: pathlib.Path, translation_json: pathlib.Path) -> bool:
+    """Whether `words.bin` is newer than `llm/` and the sentences it refers to."""
+    mtime = _mtime(root / INDEX_FILENAME)
+    if mtime == 0:
+        return False
+    llm_root = root / "llm"
+    mtimes = [_mtime(llm_root), _mtime(root / STORE_FILENAME), _mtime(translation_json)]
+    try:
+        with os.scandir(llm_root) as it:
+            mtimes += [e.stat().st_mtime for e in it]
+    except FileNotFoundError:
+        pass
+    return max(mtimes) <= mtime
+
+
+def save(root: pathlib.Path, store: SentenceStore) -> None:
+    tmp = root / f"{INDEX_FILENAME}.tmp"
+    tmp.write_bytes(convert(root / "llm", store))
+    tmp.replace(root / INDEX_FILENAME)
+
+
+def load_or_convert(root: pathlib.Path, translation_json: pathlib.Path, store: SentenceStore) -> WordIndex:
+    """Memory-map `words.bin`, or build the index in memory if it is missing or outdated."""
+    if is_fresh(root, translation_json):
+        return WordIndex.open(root / INDEX_FILENAME)
+    return WordIndex(convert(root / "llm", store))
@@ -31,3 +31,9 @@ LOGLEVEL=DEBUG python tools/image.py $ROOT/translation_en.json $ROOT/image/ \
 
 # Merge the audio file so that it is nicer to listen to
 # python tools/merge_audio.py $ROOT/translation_en.json $ROOT/audio/ $ROOT/audio_per_word/
+
+# Alternatively, run all the steps above as one streaming pipeline.
+# Images go to $ROOT/image-horizontal/, where the backend serves them (see --image-root).
+# LOGLEVEL=INFO python tools/pipeline.py $ROOT hi en Hindi Devanagri \
+#     "{'hi': ['hi-IN-Neural2-A', 'hi-IN-Neural2-D', 'hi-IN-Wavenet-E'], 'en': ['en-US-Wavenet-H',]}" \
+#     --prompt-json assets/comfyui.json --api "http://localhost:8188" --merge
@@ -7,3 +7,109 @@ print(v)
 r2 = vocagen.ReversibleRandom(v)
 assert r1.next() == r2.next()
 print(f"{r1.seed()}, {r2.seed()}")
+
+# advance / rewind / next_n / prev_n are equivalent to repeated next() / prev()
+import random
+rng = random.Random(0)
+for _ in range(20):
+    seed = rng.getrandbits(64)
+    k = rng.randrange(0, 300)
+
+    r_step = vocagen.ReversibleRandom(seed)
+    values = [int(r_step.next()) for _ in range(k)]
+    r_jump = vocagen.ReversibleRandom(seed)
+    assert int(r_jump.advance(k)) == int(r_step.seed()), (seed, k)
+    assert [int(x) for x in vocagen.ReversibleRandom(seed).next_n(k)] == values, (seed, k)
+
+    # Reversibility
+    assert int(r_jump.rewind(k)) == seed, (seed, k)
+    r_back = vocagen.ReversibleRandom(r_step.seed())
+    assert [int(x) for x in r_back.prev_n(k)] == [*values[-2::-1], seed][:k], (seed, k)
+    assert int(r_back.seed()) == seed, (seed, k)
+    r_back = vocagen.ReversibleRandom(r_step.seed())
+    assert [int(r_back.prev()) for _ in range(k)] == [*values[-2::-1], seed][:k], (seed, k)
+    assert int(vocagen.ReversibleRandom(seed).advance(-k)) == int(vocagen.ReversibleRandom(seed).rewind(k))
+print("advance/rewind/next_n/prev_n OK")
+
+# Engines are bit-identical
+for engine in ["python", "numba"]:
+    r_engine = vocagen.ReversibleRandom(4771436933726426000, engine=engine)
+    r_python = vocagen.ReversibleRandom(4771436933726426000, engine="python")
+    for _ in range(100):
+        assert int(r_engine.next()) == int(r_python.next()), engine
+    for _ in range(200):
+        assert int(r_engine.prev()) == int(r_python.prev()), engine
+    values = [r_engine.next(), r_engine.prev(), r_engine.advance(3), r_engine.rewind(3), r_engine.seed()]
+    assert {type(v).__name__ for v in values} == {"uint64"}, (engine, values)
+print("engines OK")
+
+# A language pair loads whatever the header of its frequency list calls the word column
+import json
+import pathlib
+import tempfile
+
+from backend import difficulty, resource_util
+
+with tempfile.TemporaryDirectory() as tmp:
+    root = pathlib.Path(tmp) / "en" / "hi"
+    root.mkdir(parents=True)
+    (root / "frequency.csv").write_text("rank,frequency,word_hi,word_en\n1,46471,में,mẽ\n2,22405,है,hai\n", encoding="utf-8")
+    (root / "translation_en.json").write_text(json.dumps({"यह घर में है": "It is in the house"}), encoding="utf-8")
+    assert difficulty.read_ranks(root / "frequency.csv") == {"में": 1, "है": 2}
+    pair = resource_util.LanguagePair.load("en", "hi", root)
+    assert pair.difficulty.arrays["max_rank"].tolist() == [2], pair.difficulty.arrays["max_rank"]
+print("frequency.csv OK")
+
+# Increments survive a failed flush
+import sqlite3
+
+from backend import dbutils
+from backend.types import User
+
+with tempfile.TemporaryDirectory() as tmp:
+    dbutils.DB_PATH = pathlib.Path(tmp) / "users.sqlite3"
+    user = User("a@example.com")
+    dbutils.update_user_statistics(user, {"per_language_pair": {"en": {"hi": {"n_sentences": 2}}}})
+    write = dbutils._write_user_statistics
+
+    def failing_write(conn, email, counter):
+        raise sqlite3.OperationalError("database is locked")
+
+    dbutils._write_user_statistics = failing_write
+    try:
+        dbutils.flush_user_statistics()
+        assert False, "flush should raise"
+    except sqlite3.OperationalError:
+        pass
+    finally:
+        dbutils._write_user_statistics = write
+    dbutils.update_user_statistics(user, {"per_language_pair": {"en": {"hi": {"n_sentences": 1}}}})
+    dbutils.flush_user_statistics()
+    assert dbutils._pending == {}
+    stat = dbutils.get_user_statistics(user)
+    assert stat.per_language_pair["en"]["hi"].n_sentences == 3, stat
+    dbutils._local.conn.close()
+    del dbutils._local.conn
+print("statistics flush OK")
+
+# Search index: postings round-trip through the varint encoding, queries match a scan of the sentences
+import numpy as np
+
+from backend import search_index, sentence_store
+
+for values in [[], [0], [5, 127, 128, 16383, 16384, 2**21 + 3, 2**31 - 1], list(range(0, 10**6, 997))]:
+    decoded = search_index._decode(np.frombuffer(search_index._varints(values), dtype=np.uint8))
+    assert decoded.tolist() == values, values
+
+store = sentence_store.SentenceStore(sentence_store.convert({
+    "私は猫が好きです。": "I like cats.",
+    "猫は寝ています。": "The cat is sleeping.",
+    "犬が好きです。": "I like dogs.",
+    "今日は晴れです。": "It is sunny today.",
+}))
+search = search_index.SearchIndex(search_index.convert(store, "en", "ja"))
+for query in ["猫", "好き", "猫が好き", "like", "I like", "cat", "sunny today", "鳥", "zebra"]:
+    expected = [i for i in range(len(store)) if query in store.sentence_L2(i) or
+                set(query.lower().split()) <= set(store.sentence_L1(i).lower().rstrip(".").split())]
+    assert search.search(query, "en", "ja").tolist() == expected, (query, search.search(query, "en", "ja"), expected)
+print("search index OK")
@@ -0,0 +1,43 @@
+"""Measure import time and first-call latency of `vocagen` for each engine.
+
+Each measurement runs in a fresh interpreter, as a newly spawned worker would.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+SNIPPET = """
+import json, time
+t0 = time.perf_counter()
+import vocagen
+t1 = time.perf_counter()
+r = vocagen.ReversibleRandom(4771436933726426000)
+r.next()
+t2 = time.perf_counter()
+for _ in range(10000):
+    r.next()
+t3 = time.perf_counter()
+print(json.dumps({"import": t1 - t0, "first_call": t2 - t1, "per_call": (t3 - t2) / 10000}))
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--engines", nargs="+", default=["python", "numba"])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    for engine in args.engines:
+        for i in range(args.repeat):
+            env = {**os.environ, "VOCAGEN_ENGINE": engine, "PYTHONPATH": root}
+            out = subprocess.run([sys.executable, "-c", SNIPPET], env=env, check=True, capture_output=True, text=True)
+            res = json.loads(out.stdout)
+            print(f"{engine: <7} run {i}: import {res['import'] * 1e3:8.1f} ms, "
+                  f"first call {res['first_call'] * 1e3:8.1f} ms, per call {res['per_call'] * 1e6:6.2f} us")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+"""Content-addressed store of generated outputs, shared by all language pairs.
+
+An output is keyed by (operation, model or voice, sha256 of the input text), so
+that e.g. the TTS of an English sentence is paid for once, not once per
+`assets/en/<L2>`. Files are handed out to the per-pair directories as
+hardlinks, or reflinks / copies across file systems. Each hand-out is
+recorded as a reference; `gc` deletes the blobs none of whose references
+exist anymore.
+
+A hardlinked output shares its content with the blob, so outputs must only
+ever be replaced by writing a new file and `os.replace`-ing it, as the tools
+do, never rewritten in place. Outputs are added to the store as reflinks or
+copies, so that the caller's file stays independent of the blob.
+
+The store is used by the generation tools when `--cache` (or `$VOCAGEN_CACHE`)
+is set:
+
+    python tools/cas.py stats --cache assets/.cas
+    python tools/cas.py gc --cache assets/.cas [--dry-run]
+"""
+import argparse
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+from pathlib import Path
+
+# From linux/fs.h
+FICLONE = 0x40049409
+
+
+def _clone(src: Path, dst: Path, link: bool = True) -> None:
+    """Hardlink if `link`, or reflink, or copy as the last resort."""
+    if link:
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass
+    with src.open("rb") as f_src, dst.open("wb") as f_dst:
+        try:
+            fcntl.ioctl(f_dst.fileno(), FICLONE, f_src.fileno())
+            return
+        except OSError:
+            pass
+        shutil.copyfileobj(f_src, f_dst)
+
+
+def _place(src: Path, dst: Path, link: bool = True) -> None:
+    """Atomically make `dst` have the content of `src`."""
+    tmp = dst.with_name(f".{dst.name}.tmp")
+    tmp.unlink(missing_ok=True)
+    _clone(src, tmp, link)
+    os.replace(tmp, dst)
+
+
+class Store:
+    def __init__(self, root: Path) -> None:
+        self.root = root
+        (root / "objects").mkdir(parents=True, exist_ok=True)
+        self.run_statistics = {}  # operation to [hits, misses] of this process
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(root / "index.sqlite3", timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS blobs (key TEXT PRIMARY KEY, operation TEXT, model TEXT, size INTEGER);
+            CREATE TABLE IF NOT EXISTS refs (key TEXT, path TEXT, PRIMARY KEY (key, path));
+            CREATE TABLE IF NOT EXISTS statistics (operation TEXT PRIMARY KEY, hits INTEGER, misses INTEGER);
+        """)
+
+    @staticmethod
+    def key(operation: str, model: str, text: str) -> str:
+        digest = hashlib.sha256(text.encode('utf8')).hexdigest()
+        return hashlib.sha256(json.dumps([operation, model, digest]).encode('utf8')).hexdigest()
+
+    def _blob(self, key: str) -> Path:
+        return self.root / "objects" / key[:2] / key
+
+    def _execute(self, sql: str, params=()) -> list:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _count(self, operation: str, hit: bool) -> None:
+        with self._lock:
+            self.run_statistics.setdefault(operation, [0, 0])[0 if hit else 1] += 1
+        self._execute(
+            "INSERT INTO statistics (operation, hits, misses) VALUES (?, ?, ?) "
+            "ON CONFLICT (operation) DO UPDATE SET hits = hits + excluded.hits, misses = misses + excluded.misses",
+            (operation, int(hit), int(not hit)),
+        )
+
+    def _reference(self, key: str, path: Path) -> None:
+        self._execute("INSERT OR IGNORE INTO refs (key, path) VALUES (?, ?)", (key, str(path.resolve())))
+
+    def get(self, operation: str, model: str, text: str, save_to: Path) -> bool:
+        """Place the stored output at `save_to`. False if there is none."""
+        key = self.key(operation, model, text)
+        blob = self._blob(key)
+        hit = blob.exists()
+        self._count(operation, hit)
+        if hit:
+            _place(blob, save_to)
+            self._reference(key, save_to)
+        return hit
+
+    def add(self, operation: str, model: str, text: str, path: Path) -> None:
+        """Store the output file at `path`."""
+        key = self.key(operation, model, text)
+        blob = self._blob(key)
+        if not blob.exists():
+            blob.parent.mkdir(exist_ok=True)
+            _place(path, blob, link=False)
+            self._execute("INSERT OR REPLACE INTO blobs (key, operation, model, size) VALUES (?, ?, ?, ?)",
+                          (key, operation, model, blob.stat().st_size))
+        self._reference(key, path)
+
+    def get_text(self, operation: str, model: str, text: str, ref: Path) -> str | None:
+        """Stored output text, referenced by the file `ref` it is written to."""
+        key = self.key(operation, model, text)
+        try:
+            value = self._blob(key).read_text(encoding="utf-8")
+        except FileNotFoundError:
+            self._count(operation, False)
+            return None
+        self._count(operation, True)
+        self._reference(key, ref)
+        return value
+
+    def add_text(self, operation: str, model: str, text: str, value: str, ref: Path) -> None:
+        key = self.key(operation, model, text)
+        blob = self._blob(key)
+        if not blob.exists():
+            blob.parent.mkdir(exist_ok=True)
+            tmp = blob.with_name(f".{blob.name}.tmp")
+            tmp.write_text(value, encoding="utf-8")
+            os.replace(tmp, blob)
+            self._execute("INSERT OR REPLACE INTO blobs (key, operation, model, size) VALUES (?, ?, ?, ?)",
+                          (key, operation, model, blob.stat().st_size))
+        self._reference(key, ref)
+
+    def statistics(self) -> dict[str, dict]:
+        """Hits and misses, number of blobs and their size per operation."""
+        ret = {}
+        for operation, hits, misses in self._execute("SELECT operation, hits, misses FROM statistics"):
+            ret[operation] = {"hits": hits, "misses": misses, "blobs": 0, "bytes": 0}
+        for operation, n, size in self._execute("SELECT operation, COUNT(*), SUM(size) FROM blobs GROUP BY operation"):
+            ret.setdefault(operation, {"hits": 0, "misses": 0})
+            ret[operation].update(blobs=n, bytes=size)
+        return ret
+
+    def gc(self, dry_run: bool = False) -> tuple[int, int]:
+        """Delete the blobs whose references are all gone. Returns the number of blobs and bytes freed."""
+        n_blobs, n_bytes = 0, 0
+        key2paths = {}
+        for key, path in self._conn.execute("SELECT key, path FROM refs"):
+            key2paths.setdefault(key, []).append(path)
+        for key, size in self._conn.execute("SELECT key, size FROM blobs").fetchall():
+            paths = key2paths.get(key, [])
+            gone = [p for p in paths if not os.path.exists(p)]
+            if not dry_run:
+                self._conn.executemany("DELETE FROM refs WHERE key = ? AND path = ?", [(key, p) for p in gone])
+            if len(gone) < len(paths):
+                continue
+            n_blobs += 1
+            n_bytes += size
+            if not dry_run:
+                self._blob(key).unlink(missing_ok=True)
+                self._conn.execute("DELETE FROM blobs WHERE key = ?", (key,))
+        return n_blobs, n_bytes
+
+
+def add_arguments(parser) -> None:
+    parser.add_argument("--cache", type=Path, default=os.environ.get("VOCAGEN_CACHE"),
+                        help="Content-addressed store shared by the language pairs, see tools/cas.py. "
+                             "Defaults to $VOCAGEN_CACHE; disabled if neither is set.")
+
+
+def from_args(args) -> Store | None:
+    return None if args.cache is None else Store(args.cache)
+
+
+def log_statistics(store: Store | None) -> None:
+    if store is None:
+        return
+    for operation, (hits, misses) in sorted(store.run_statistics.items()):
+        logging.info("Cache %s: %s hits, %s misses", operation, hits, misses)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["stats", "gc"])
+    parser.add_argument("--dry-run", action="store_true", help="Only report what gc would delete")
+    add_arguments(parser)
+    args = parser.parse_args()
+    if args.cache is None:
+        parser.error("--cache is required")
+
+    store = Store(args.cache)
+    if args.command == "stats":
+        print(json.dumps(store.statistics(), indent=2))
+    else:
+        n_blobs, n_bytes = store.gc(args.dry_run)
+        print(f"{'Would free' if args.dry_run else 'Freed'} {n_blobs} blobs, {n_bytes / 1e6:.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+"""Client of ComfyUI servers, shared by the image generation scripts.
+
+- Completion is notified over ComfyUI's websocket (`/ws`) if the
+  `websocket-client` package is installed, with adaptive polling of
+  `/history/<prompt_id>` as a fallback.
+- HTTP connections are kept alive, one per host and thread.
+- Each host has up to `queue_depth` prompts queued, so that the GPU never waits
+  for the next prompt (which also prevents unloading of the model).
+- Prompts are dispatched over several hosts, round robin or to the least loaded one.
+"""
+import concurrent.futures
+import http.client
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+import urllib.parse
+import uuid
+from pathlib import Path
+
+try:
+    import websocket
+except ImportError:
+    websocket = None
+
+
+class Host:
+    """A single ComfyUI server."""
+
+    def __init__(self, url: str, use_websocket: bool = True) -> None:
+        self.url = url.rstrip("/")
+        parsed = urllib.parse.urlsplit(self.url)
+        self._netloc = parsed.netloc
+        self._https = parsed.scheme == "https"
+        self.client_id = uuid.uuid4().hex
+        self.n_in_flight = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._done: dict[str, threading.Event] = {}
+        # prompt id -> type of the message that reported its failure
+        self._failed: dict[str, str] = {}
+        self._websocket_alive = False
+        if use_websocket and websocket is not None:
+            threading.Thread(target=self._listen, daemon=True).start()
+
+    def _connection(self) -> http.client.HTTPConnection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = (http.client.HTTPSConnection if self._https else http.client.HTTPConnection)(self._netloc, timeout=60)
+            self._local.conn = conn
+        return conn
+
+    def request(self, method: str, path: str, body: bytes | None = None) -> bytes:
+        headers = {} if body is None else {"Content-Type": "application/json; charset=utf-8"}
+        for i_try in range(2):  # Reconnect once if the server closed the kept-alive connection
+            conn = self._connection()
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                resp = conn.getresponse()
+                data = resp.read()
+            except (http.client.HTTPException, ConnectionError):
+                conn.close()
+                self._local.conn = None
+                if i_try == 1:
+                    raise
+                continue
+            if resp.status >= 400:
+                raise RuntimeError(f"{method} {self.url}{path} failed with {resp.status}: {data[:200]!r}")
+            return data
+
+    def _listen(self) -> None:
+        """Set the completion events from the websocket messages, reconnecting when dropped."""
+        scheme = "wss" if self._https else "ws"
+        while True:
+            try:
+                ws = websocket.create_connection(f"{scheme}://{self._netloc}/ws?clientId={self.client_id}")
+                self._websocket_alive = True
+                while True:
+                    message = ws.recv()
+                    if not isinstance(message, str):
+                        continue  # Binary previews
+                    message = json.loads(message)
+                    data = message.get("data", {})
+                    if not (
+                        (message["type"] == "executing" and data.get("node") is None) or
+                        message["type"] in ("execution_success", "execution_error", "execution_interrupted")
+                    ):
+                        continue
+                    with self._lock:
+                        # Only prompts being waited for; others (or ones already waited for) would pile up
+                        event = self._done.get(data.get("prompt_id"))
+                        if event is None:
+                            continue
+                        if message["type"] in ("execution_error", "execution_interrupted"):
+                            self._failed[data["prompt_id"]] = message["type"]
+                    event.set()
+            except Exception as e:
+                logging.debug("Websocket of %s disconnected: %s", self.url, e)
+            self._websocket_alive = False
+            # Wake up the waiting threads, which check the history themselves
+            with self._lock:
+                for event in self._done.values():
+                    event.set()
+            time.sleep(1)
+
+    def _event(self, prompt_id: str) -> threading.Event:
+        with self._lock:
+            return self._done.setdefault(prompt_id, threading.Event())
+
+    def submit(self, prompt_json: str) -> str:
+        """Queue a prompt (json of `{"prompt": ...}`). Returns the prompt id."""
+        payload = json.loads(prompt_json)
+        payload["client_id"] = self.client_id
+        resp = json.loads(self.request("POST", "/prompt", json.dumps(payload).encode('utf-8')))
+        self._event(resp['prompt_id'])
+        return resp['prompt_id']
+
+    def _image_info(self, prompt_id: str) -> dict | None:
+        """Info of the first output image, None if the prompt is not done. Raises RuntimeError if it failed."""
+        history = json.loads(self.request("GET", f"/history/{prompt_id}"))
+        if history.get(prompt_id, {}).get('status', {}).get('status_str') == "error":
+            raise RuntimeError(f"Prompt {prompt_id} failed on {self.url}: {history[prompt_id]['status'].get('messages')}")
+        try:
+            return next(iter(history[prompt_id]['outputs'].values()))['images'][0]
+        except (KeyError, StopIteration):
+            return None
+
+    def wait(self, prompt_id: str, timeout: float) -> dict:
+        """Wait for a prompt to finish. Returns the info of its first output image."""
+        event = self._event(prompt_id)
+        deadline = time.monotonic() + timeout
+        interval = 0.1
+        try:
+            while True:
+                # Woken up by the websocket; otherwise poll with growing interval.
+                # Poll now and then regardless, in case a message is lost.
+                wait_for = 5.0 if self._websocket_alive else interval
+                event.wait(min(wait_for, max(0, deadline - time.monotonic())))
+                event.clear()
+                with self._lock:
+                    failure = self._failed.get(prompt_id)
+                if failure is not None:
+                    raise RuntimeError(f"Prompt {prompt_id} failed on {self.url}: {failure}")
+                image_info = self._image_info(prompt_id)
+                if image_info is not None:
+                    return image_info
+                if time.monotonic() >= deadline:
+                    raise TimeoutError(f"Prompt {prompt_id} is still running after {timeout} seconds.")
+                interval = min(interval * 1.5, 2.0)
+        finally:
+            with self._lock:
+                self._done.pop(prompt_id, None)
+                self._failed.pop(prompt_id, None)
+
+    def download(self, image_info: dict) -> bytes:
+        return self.request("GET", f"/view?{urllib.parse.urlencode(image_info)}")
+
+
+class Pool:
+    """Dispatch prompts over ComfyUI hosts, keeping up to `queue_depth` prompts queued on each."""
+
+    def __init__(self, urls: list[str], queue_depth: int = 2, dispatch: str = "least-loaded",
+                 timeout: float = 600, use_websocket: bool = True) -> None:
+        if dispatch not in ("round-robin", "least-loaded"):
+            raise ValueError(f"Unknown dispatch {dispatch}")
+        self.hosts = [Host(url, use_websocket) for url in urls]
+        self.queue_depth = queue_depth
+        self.dispatch = dispatch
+        self.timeout = timeout
+        self._round_robin = itertools.cycle(self.hosts)
+        self._slots = threading.Condition()
+
+    def _acquire(self) -> Host:
+        with self._slots:
+            while True:
+                free = [h for h in self.hosts if h.n_in_flight < self.queue_depth]
+                if free:
+                    break
+                self._slots.wait()
+            if self.dispatch == "round-robin":
+                host = next(h for h in self._round_robin if h.n_in_flight < self.queue_depth)
+            else:
+                host = min(free, key=lambda h: h.n_in_flight)
+            host.n_in_flight += 1
+            return host
+
+    def _release(self, host: Host) -> None:
+        with self._slots:
+            host.n_in_flight -= 1
+            self._slots.notify()
+
+    def generate(self, prompt_json: str, save_to: Path) -> None:
+        """Run a prompt and save its first output image, written atomically."""
+        host = self._acquire()
+        try:
+            prompt_id = host.submit(prompt_json)
+            image_info = host.wait(prompt_id, self.timeout)
+        finally:
+            self._release(host)
+        content = host.download(image_info)
+        tmp = save_to.with_name(f".{save_to.name}.tmp")
+        tmp.write_bytes(content)
+        os.replace(tmp, save_to)
+        logging.info(f"Saved to {save_to} ({host.url})")
+
+    def run(self, jobs, on_saved=None) -> int:
+        """Run `(prompt_json, save_to)` jobs concurrently, calling `on_saved(save_to)` after each. Returns the number of failures."""
+        n_failed = 0
+        with concurrent.futures.ThreadPoolExecutor(len(self.hosts) * self.queue_depth) as executor:
+            futures = {}
+            for prompt_json, save_to in jobs:
+                # Submit lazily, so that prompts are built only shortly before they are queued
+                while len(futures) >= 2 * len(self.hosts) * self.queue_depth:
+                    n_failed += self._collect(futures, concurrent.futures.FIRST_COMPLETED, on_saved)
+                futures[executor.submit(self.generate, prompt_json, save_to)] = save_to
+            while futures:
+                n_failed += self._collect(futures, concurrent.futures.ALL_COMPLETED, on_saved)
+        return n_failed
+
+    @staticmethod
+    def _collect(futures: dict, return_when, on_saved) -> int:
+        done, _ = concurrent.futures.wait(futures, return_when=return_when)
+        n_failed = 0
+        for future in done:
+            save_to = futures.pop(future)
+            try:
+                future.result()
+            except Exception as e:
+                logging.error("Failed to generate %s: %s", save_to, e)
+                n_failed += 1
+                continue
+            if on_saved is not None:
+                on_saved(save_to)
+        return n_failed
+
+
+def add_arguments(parser, required: bool = True) -> None:
+    """Command line options of the pool, shared by the scripts."""
+    parser.add_argument("--api", type=str, required=required, action="append",
+                        help="ComfyUI host URL. Repeat to use several hosts.")
+    parser.add_argument("--queue-depth", type=int, default=2, help="Prompts queued per host")
+    parser.add_argument("--dispatch", choices=["least-loaded", "round-robin"], default="least-loaded")
+    parser.add_argument("--timeout", type=float, default=600, help="Seconds to wait for a prompt")
+
+
+def from_args(args) -> Pool:
+    return Pool(args.api, args.queue_depth, args.dispatch, args.timeout)
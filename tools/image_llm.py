@@ -2,60 +2,45 @@
 """Using google text to speech API to generate audio files for the words"""
 import argparse
 import hashlib
-import itertools
 import json
 import logging
 import random
-import time
-import urllib
-import urllib.request
 from pathlib import Path
 
-import tqdm
+import cas
+import comfyui
+from image_raw import model_id
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("prompt_root", type=Path)
     parser.add_argument("out_root", type=Path)
-    parser.add_argument("--api", type=str, required=True, help="ComfyUI host URL")
     parser.add_argument("--prompt-json", type=Path, required=True, help="Prompt JSON file for ComfyUI")
     parser.add_argument("--additional-prompt", type=str, help="Additional prompt string")
+    comfyui.add_arguments(parser)
+    cas.add_arguments(parser)
     args = parser.parse_args()
 
-    comfyui_prompt_json = json.dumps({"prompt": json.loads(args.prompt_json.read_text())})
-
     args.out_root.mkdir(parents=True, exist_ok=True)
-    
-    # We will keep 2 prompts in the queue at a time to avoid overloading the server with too many prompts,
-    # But also to keep the server busy by always having a prompt to work on, which (hopefully) prevents unloading of the model.
-    queue = []
+    store = cas.from_args(args)
+    save_to2text = {}
+    model = model_id(args.prompt_json.read_text(), args.additional_prompt or "")
 
+    def on_saved(save_to: Path) -> None:
+        if store is not None:
+            store.add("image", model, save_to2text.pop(save_to), save_to)
 
-    def retrieve(prompt_id: str, text_raw: str, text_prompt: str, save_to: Path):
-        for i in itertools.count():
-            try:
-                resp_history = json.loads(urllib.request.urlopen(f"{args.api}/history/{prompt_id}").read())
-                image_info = next(iter(resp_history[prompt_id]['outputs'].values()))['images'][0]
-                break
-            except KeyError:
-                # Prompt is still running. Wait a bit
-                if i > 180:
-                    logging.error(f"Prompt is still running after 180 seconds. Quitting ...")
-                    return
-                logging.debug(f"Waiting for the prompt to finish... (retrying {i: >2})")
-                time.sleep(1)
-                continue
+    n_failed = comfyui.from_args(args).run(jobs(args, store, save_to2text), on_saved)
+    cas.log_statistics(store)
+    if n_failed > 0:
+        logging.error("Failed to generate %s images. Run again to retry.", n_failed)
 
-        # Download the files from the server
-        with urllib.request.urlopen(f"{args.api}/view?{urllib.parse.urlencode(image_info)}") as resp:
-            resp = resp.read()
-            with open(save_to, "wb") as f:
-                f.write(resp)
-                logging.info(text_raw)
-                logging.info(text_prompt)
-                logging.info(f"Saved to {save_to}")
 
+def jobs(args, store: cas.Store | None = None, save_to2text: dict | None = None):
+    """`(ComfyUI prompt json, save_to)` of the images not generated yet, nor in the store."""
+    comfyui_prompt_json = json.dumps({"prompt": json.loads(args.prompt_json.read_text())})
+    model = model_id(args.prompt_json.read_text(), args.additional_prompt or "")
     for file in sorted(args.prompt_root.glob("*.json")):
         content = json.loads(file.read_text())
         prompt_text = ', '.join(content['keywords']) + ". " + content['description']
@@ -65,6 +50,10 @@ def main():
         save_to = args.out_root / f"{sentence_id}.png"
         if save_to.exists():
             continue
+        if store is not None and store.get("image", model, prompt_text, save_to):
+            continue
+        if save_to2text is not None:
+            save_to2text[save_to] = prompt_text
 
         # Generate image from comfyui
         prompt_json = comfyui_prompt_json
@@ -73,21 +62,9 @@ def main():
         prompt_json = prompt_json.replace("\"_SEED_\"", str(random.randint(0, 1000000)))
         # logging.debug(f"Raw JSON: {prompt_json}")
 
-        req = urllib.request.Request(f"{args.api}/prompt")
-        req.add_header('Content-Type', 'application/json; charset=utf-8')
-        jsonbytes = prompt_json.encode('utf-8')
-        req.add_header('Content-Length', len(jsonbytes))
-        with urllib.request.urlopen(req, jsonbytes) as resp:
-            resp = json.loads(resp.read().decode('utf-8'))
-
-        prompt_id = resp['prompt_id']
-        queue.append((prompt_id, text_raw, prompt_text, save_to))
-
-        while len(queue) > 1:
-            retrieve(*queue.pop(0))
-
-    while queue:
-        retrieve(*queue.pop(0))
+        logging.info(text_raw)
+        logging.info(prompt_text)
+        yield prompt_json, save_to
 
 
 if __name__ == '__main__':
@@ -2,17 +2,16 @@
 """Using google text to speech API to generate audio files for the words"""
 import argparse
 import hashlib
-import itertools
 import json
 import logging
 import random
-import time
-import urllib
-import urllib.request
 from pathlib import Path
 
 import tqdm
 
+import cas
+import comfyui
+
 
 def main():
     parser = argparse.ArgumentParser()
@@ -20,41 +19,35 @@ def main():
     parser.add_argument("out_root", type=Path)
     parser.add_argument("--use", choices=['from', 'to'])
     parser.add_argument("--additional-prompt", type=str, default="", help="Additional prompt to add to the text")
-    parser.add_argument("--api", type=str, required=True, help="ComfyUI host URL")
     parser.add_argument("--prompt-json", type=Path, required=True, help="Prompt JSON file for ComfyUI")
+    comfyui.add_arguments(parser)
+    cas.add_arguments(parser)
     args = parser.parse_args()
 
-    comfyui_prompt_text = json.dumps({"prompt": json.loads(args.prompt_json.read_text())})
-
     args.out_root.mkdir(parents=True, exist_ok=True)
-    
-    # We will keep 2 prompts in the queue at a time to avoid overloading the server with too many prompts,
-    # But also to keep the server busy by always having a prompt to work on, which (hopefully) prevents unloading of the model.
-    queue = []
-
-
-    def retrieve(prompt_id: str, save_to: Path):
-        for i in itertools.count():
-            try:
-                resp_history = json.loads(urllib.request.urlopen(f"{args.api}/history/{prompt_id}").read())
-                image_info = next(iter(resp_history[prompt_id]['outputs'].values()))['images'][0]
-                break
-            except KeyError:
-                # Prompt is still running. Wait a bit
-                if i > 180:
-                    logging.error(f"Prompt is still running after 180 seconds. Quitting ...")
-                    return
-                print(f"Waiting for the prompt to finish... (retrying {i: >2})\r", end="")
-                time.sleep(1)
-                continue
-
-        # Download the files from the server
-        with urllib.request.urlopen(f"{args.api}/view?{urllib.parse.urlencode(image_info)}") as resp:
-            resp = resp.read()
-            with open(save_to, "wb") as f:
-                f.write(resp)
-                print(f"Saved to {save_to}")
+    store = cas.from_args(args)
+    save_to2text = {}
+    model = model_id(args.prompt_json.read_text(), args.additional_prompt)
+
+    def on_saved(save_to: Path) -> None:
+        if store is not None:
+            store.add("image", model, save_to2text.pop(save_to), save_to)
+
+    n_failed = comfyui.from_args(args).run(jobs(args, store, save_to2text), on_saved)
+    cas.log_statistics(store)
+    if n_failed > 0:
+        logging.error("Failed to generate %s images. Run again to retry.", n_failed)
+
 
+def model_id(prompt_json_text: str, additional_prompt: str) -> str:
+    """Identifies the workflow in the cache key of the images."""
+    return hashlib.sha256((prompt_json_text + additional_prompt).encode('utf8')).hexdigest()[:16]
+
+
+def jobs(args, store: cas.Store | None = None, save_to2text: dict | None = None):
+    """`(ComfyUI prompt json, save_to)` of the images not generated yet, nor in the store."""
+    comfyui_prompt_text = json.dumps({"prompt": json.loads(args.prompt_json.read_text())})
+    model = model_id(args.prompt_json.read_text(), args.additional_prompt)
     s2s = json.loads(args.json.read_text())
     for s_from, s_to in tqdm.tqdm(sorted(s2s.items())):
         text = args.use == 'from' and s_from or s_to
@@ -63,31 +56,28 @@ def main():
         save_to = args.out_root / f"{sentence_id}.png"
         if save_to.exists():
             continue
+        if store is not None and store.get("image", model, text, save_to):
+            continue
+        if save_to2text is not None:
+            save_to2text[save_to] = text
 
         # Generate image from comfyui
-        prompt_text = comfyui_prompt_text
-        prompt_text = prompt_text.replace("_PROMPT_TEXT_REPLACE_", f"({text}:1.2), {args.additional_prompt}")
-        prompt_text = prompt_text.replace("_FILENAME_PREFIX__REPLACE_", sentence_id)
-        prompt_text = prompt_text.replace("\"_SEED_\"", str(random.randint(0, 1000000)))
+        prompt_text = build_prompt(comfyui_prompt_text, text, sentence_id, args.additional_prompt)
         logging.info(f"Prompt: {text}")
         # logging.debug(f"Raw JSON: {prompt_text}")
 
-        req = urllib.request.Request(f"{args.api}/prompt")
-        req.add_header('Content-Type', 'application/json; charset=utf-8')
-        jsonbytes = prompt_text.encode('utf-8')
-        req.add_header('Content-Length', len(jsonbytes))
-        with urllib.request.urlopen(req, jsonbytes) as resp:
-            resp = json.loads(resp.read().decode('utf-8'))
+        yield prompt_text, save_to
 
-        prompt_id = resp['prompt_id']
-        queue.append((prompt_id, save_to))
 
-        while len(queue) > 1:
-            retrieve(*queue.pop(0))
+def build_prompt(comfyui_prompt_text: str, text: str, sentence_id: str, additional_prompt: str) -> str:
+    """Fill in the ComfyUI prompt template for a sentence."""
+    prompt_text = comfyui_prompt_text
+    # Escaped, as it is placed inside a JSON string
+    prompt_text = prompt_text.replace("_PROMPT_TEXT_REPLACE_", json.dumps(f"({text}:1.2), {additional_prompt}")[1:-1])
+    prompt_text = prompt_text.replace("_FILENAME_PREFIX__REPLACE_", sentence_id)
+    prompt_text = prompt_text.replace("\"_SEED_\"", str(random.randint(0, 1000000)))
+    return prompt_text
 
-    while queue:
-        retrieve(*queue.pop(0))
-        
 
 if __name__ == '__main__':
     import os
@@ -1,11 +1,26 @@
+"""Generate example sentences for the most frequent words with an LLM.
+
+Requests are sent concurrently within a request/token budget per minute.
+Set `OPENAI_BASE_URL` to use another OpenAI compatible server, e.g. `tools/stub_openai.py`.
+"""
 import argparse
+import asyncio
+import collections
+import itertools
 import json
 import logging
+import os
+import random
+import time
 from pathlib import Path
 
+import openai
 import pandas as pd
 import tqdm
-from openai import OpenAI
+
+import cas
+
+MODEL = "gpt-4o-2024-05-13"
 
 
 def ordinal_en(n: int):
@@ -86,6 +101,127 @@ def ordinal_hi(n: int) -> str:
     return f'{n}वें'
 
 
+class RateLimiter:
+    """Budget of requests and tokens per sliding minute."""
+
+    def __init__(self, requests_per_minute: int | None, tokens_per_minute: int | None) -> None:
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._events: collections.deque[list] = collections.deque()  # [time, tokens]
+
+    async def acquire(self, tokens: int) -> list:
+        """Wait until a request of `tokens` fits in the budget. Returns an entry to correct with `settle`."""
+        while True:
+            now = time.monotonic()
+            while self._events and self._events[0][0] <= now - 60:
+                self._events.popleft()
+            n_tokens = sum(t for _, t in self._events)
+            if (
+                (self.requests_per_minute is None or len(self._events) < self.requests_per_minute) and
+                (self.tokens_per_minute is None or not self._events or n_tokens + tokens <= self.tokens_per_minute)
+            ):
+                event = [now, tokens]
+                self._events.append(event)
+                return event
+            await asyncio.sleep(self._events[0][0] + 60 - now)
+
+    @staticmethod
+    def settle(event: list, tokens: int) -> None:
+        """Replace the estimated token count with the actual usage."""
+        event[1] = tokens
+
+
+# Rough upper bound of a reply of 10 sentences, used until the actual usage is known
+ESTIMATED_COMPLETION_TOKENS = 500
+
+
+def backoff_seconds(i_try: int, error: openai.APIStatusError | None = None) -> float:
+    """Exponential backoff with full jitter, honoring `Retry-After` if the server sent one."""
+    try:
+        return float(error.response.headers["retry-after"])
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return random.uniform(0, min(60, 2 ** i_try))
+
+
+def write_atomic(save_to: Path, text: str) -> None:
+    """Write via a temporary file so that an interrupted run never leaves a partial file to be skipped."""
+    tmp = save_to.with_name(f".{save_to.name}.tmp")
+    tmp.write_text(text)
+    os.replace(tmp, save_to)
+
+
+async def generate(client: openai.AsyncOpenAI, limiter: RateLimiter, semaphore: asyncio.Semaphore,
+                   query_str: str, word: str, save_to: Path, max_retries: int, store: cas.Store | None = None) -> bool:
+    if store is not None and store.get("llm", MODEL, query_str, save_to):
+        return True
+    logging.debug("LLM Request: %s", query_str)
+    async with semaphore:
+        n_parse_failures = 0
+        for i_try in itertools.count():
+            event = await limiter.acquire(len(query_str) // 4 + ESTIMATED_COMPLETION_TOKENS)
+            try:
+                completion = await client.chat.completions.create(
+                    model=MODEL,
+                    messages=[
+                        {"role": "user", "content": query_str}
+                    ],
+                    response_format={"type": "json_object"},
+                )
+            except (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError) as e:
+                if i_try >= max_retries:
+                    logging.error("Giving up on %s after %s tries: %s", word, i_try + 1, e)
+                    return False
+                wait = backoff_seconds(i_try, e if isinstance(e, openai.APIStatusError) else None)
+                logging.info("Retrying %s in %.1f seconds: %s", word, wait, e)
+                await asyncio.sleep(wait)
+                continue
+            if completion.usage is not None:
+                limiter.settle(event, completion.usage.total_tokens)
+            reply = completion.choices[0].message.content
+            reply = reply.replace('```json', '').replace('```', '')
+            try:
+                _ = json.loads(reply)
+                break
+            except json.decoder.JSONDecodeError:
+                n_parse_failures += 1
+                if n_parse_failures >= 3:  # max try 3 times
+                    logging.error("Failed to parse JSON after 3 tries: %s. Something is wrong.", reply)
+                    return False
+                logging.info("Trying again after failing to parse JSON: %s", reply)
+                continue
+    logging.debug("LLM Reply: %s", reply)
+    reply = json.loads(reply)
+    reply['word'] = word
+    write_atomic(save_to, json.dumps(reply))
+    if store is not None:
+        store.add("llm", MODEL, query_str, save_to)
+    return True
+
+
+async def run(args) -> None:
+    # Retries are done here, with jitter and the rate limit in mind
+    client = openai.AsyncOpenAI(max_retries=0)
+    limiter = RateLimiter(args.requests_per_minute, args.tokens_per_minute)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    store = cas.from_args(args)
+
+    df = pd.read_csv(args.frequency_csv)
+    jobs = []
+    for rank, _, word, word_description in df.head(args.max_words).itertuples(index=False):  # ignore frequency
+        save_to = args.save_to / f"{rank:0>5}.json"
+        if save_to.exists():
+            continue
+        query_str = query_string(rank, word, word_description, args.name, args.script)
+        jobs.append(generate(client, limiter, semaphore, query_str, word, save_to, args.max_retries, store))
+
+    n_failed = 0
+    for job in tqdm.tqdm(asyncio.as_completed(jobs), total=len(jobs)):
+        n_failed += not await job
+    if n_failed > 0:
+        logging.error("Failed to generate sentences for %s words.", n_failed)
+    cas.log_statistics(store)
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("frequency_csv", type=Path)
@@ -97,47 +233,22 @@ def main():
                         help="Name of script in the language. e.g. Alphabet, Devanagari, Hangul, ...")
     parser.add_argument("--max-words", type=int,
                         help="Maximum number of words to generate sentences from.", default=1000)
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="Maximum number of requests in flight.")
+    parser.add_argument("--requests-per-minute", type=int,
+                        help="Request budget per minute. Unlimited by default.")
+    parser.add_argument("--tokens-per-minute", type=int,
+                        help="Token budget per minute. Unlimited by default.")
+    parser.add_argument("--max-retries", type=int, default=8,
+                        help="Maximum number of retries on rate limit and server errors.")
+    cas.add_arguments(parser)
 
     args = parser.parse_args()
     args.save_to.mkdir(parents=True, exist_ok=True)
-
-    client = OpenAI()
-
-    df = pd.read_csv(args.frequency_csv)
-    for i in tqdm.tqdm(range(0, min(len(df), args.max_words))):
-        rank, _, word, word_description = df.iloc[i]  # ignore frequency
-        save_to = args.save_to / f"{rank:0>5}.json"
-        if save_to.exists():
-            continue
-        query_str = query_string(rank, word, word_description, args.name, args.script)
-        logging.debug("LLM Request: %s", query_str)
-        for _ in range(3):  # max try 3 times
-            completion = client.chat.completions.create(
-                model="gpt-4o-2024-05-13",
-                messages=[
-                    {"role": "user", "content": query_str}
-                ],
-                response_format={"type": "json_object"},
-            )
-            reply = completion.choices[0].message.content
-            reply = reply.replace('```json', '').replace('```', '')
-            try:
-                _ = json.loads(reply)
-                break
-            except json.decoder.JSONDecodeError:
-                logging.info("Trying again after failing to parse JSON: %s", reply)
-                continue
-        else:
-            logging.error("Failed to parse JSON after 3 tries: %s. Something is wrong.", reply)
-            return
-        logging.debug("LLM Reply: %s", reply)
-        reply = json.loads(reply)
-        reply['word'] = word
-        save_to.write_text(json.dumps(reply))
+    asyncio.run(run(args))
 
 
 if __name__ == '__main__':
-    import os
     LOGLEVEL = os.environ.get('LOGLEVEL', 'INFO').upper()
     logging.basicConfig(level=LOGLEVEL, format="%(asctime)s %(message)s")
     main()
@@ -1,9 +1,103 @@
+"""Merge the audio files of each sentence into one, speaking L1 and L2 alternately.
+
+Two modes:
+- `copy`: MP3 frames of the inputs are joined as they are, with silent frames
+  in between, without decoding or re-encoding. Requires all inputs of a
+  sentence to share MPEG version, sample rate and channel mode.
+- `decode`: each input is decoded once, concatenated into a preallocated
+  buffer and encoded once (requires pydub and ffmpeg).
+`auto` uses `copy` whenever possible. Sentences are merged in a process pool.
+"""
+import concurrent.futures
 import hashlib
 import json
+import logging
+import os
 import pathlib
+import sys
 
 import tqdm
-from pydub import AudioSegment
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+from backend import mp3  # noqa: E402
+
+# 1 second pause in between utterances, 5 seconds pause after each sentence
+PAUSE_MS = 1000
+PAUSE_END_MS = 5000
+
+
+def _layout(audio_l1, audio_l2s):
+    """Sequence of (file or None for silence, milliseconds) to concatenate."""
+    layout = []
+    # speak L1, L2 alternatively
+    for f in audio_l2s:
+        layout += [(audio_l1, 0), (None, PAUSE_MS), (f, 0), (None, PAUSE_MS)]
+    layout.append((None, PAUSE_END_MS))
+    return layout
+
+
+def merge_copy(audio_l1: pathlib.Path, audio_l2s: list[pathlib.Path]) -> bytes | None:
+    """Join MP3 frames without re-encoding. None if the inputs do not share a format."""
+    parsed = {f: mp3.read_frames(f.read_bytes()) for f in {audio_l1, *audio_l2s}}  # Read each file once
+    formats = {(h.version_bits, h.sample_rate, h.channel_mode) for h, _ in parsed.values()}
+    if len(formats) != 1:
+        return None
+    header = parsed[audio_l1][0]
+    silences = {}
+    out = []
+    for f, duration_ms in _layout(audio_l1, audio_l2s):
+        if f is None:
+            if duration_ms not in silences:
+                silences[duration_ms] = b"".join(mp3.silent_frames(header, duration_ms))
+            out.append(silences[duration_ms])
+        else:
+            out += parsed[f][1]
+    return b"".join(out)
+
+
+def merge_decode(audio_l1: pathlib.Path, audio_l2s: list[pathlib.Path]):
+    """Decode each input once, concatenate into a preallocated buffer. Returns a pydub AudioSegment."""
+    from pydub import AudioSegment
+
+    decoded = {f: AudioSegment.from_file(f) for f in {audio_l1, *audio_l2s}}
+    reference = decoded[audio_l1]
+    frame_rate, channels, sample_width = reference.frame_rate, reference.channels, reference.sample_width
+    decoded = {
+        f: a.set_frame_rate(frame_rate).set_channels(channels).set_sample_width(sample_width).raw_data
+        for f, a in decoded.items()
+    }
+    bytes_per_ms = frame_rate * channels * sample_width // 1000
+    layout = _layout(audio_l1, audio_l2s)
+    size = sum(len(decoded[f]) if f is not None else duration_ms * bytes_per_ms for f, duration_ms in layout)
+    buffer = bytearray(size)  # Zeros, i.e. silence
+    pos = 0
+    for f, duration_ms in layout:
+        if f is None:
+            pos += duration_ms * bytes_per_ms
+        else:
+            buffer[pos:pos + len(decoded[f])] = decoded[f]
+            pos += len(decoded[f])
+    return AudioSegment(data=bytes(buffer), sample_width=sample_width, frame_rate=frame_rate, channels=channels)
+
+
+def merge(audio_l1: pathlib.Path, audio_l2s: list[pathlib.Path], save_to: pathlib.Path, mode: str) -> str:
+    """Merge one sentence, written atomically. Returns the mode actually used."""
+    tmp = save_to.with_name(f".{save_to.name}.tmp")
+    try:
+        content = merge_copy(audio_l1, audio_l2s) if mode != "decode" else None
+        if content is not None:
+            tmp.write_bytes(content)
+            used = "copy"
+        elif mode == "copy":
+            raise ValueError(f"Inputs of {save_to} differ in format, cannot copy frames.")
+        else:
+            merge_decode(audio_l1, audio_l2s).export(tmp, format="mp3")
+            used = "decode"
+        os.replace(tmp, save_to)
+    except Exception:
+        tmp.unlink(missing_ok=True)
+        raise
+    return used
 
 
 def main():
@@ -12,11 +106,19 @@ def main():
     parser.add_argument("json", type=pathlib.Path)
     parser.add_argument("audio_root", type=pathlib.Path)
     parser.add_argument("out_root", type=pathlib.Path)
+    parser.add_argument("--mode", choices=["auto", "copy", "decode"], default="auto")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
     args = parser.parse_args()
     args.out_root.mkdir(exist_ok=True, parents=True)
 
+    # List the audio directory once instead of globbing per sentence
+    prefix2files = {}
+    for p in sorted(args.audio_root.glob("*.mp3")):
+        prefix2files.setdefault(p.stem.split("_")[0], []).append(p)
+
     s2s = json.loads(args.json.read_text())
-    for s_L2, s_L1 in tqdm.tqdm(sorted(s2s.items())):
+    jobs = []
+    for s_L2, s_L1 in sorted(s2s.items()):
         prefix_L1 = hashlib.sha256(s_L1.encode('utf8')).hexdigest()
         prefix_L2 = hashlib.sha256(s_L2.encode('utf8')).hexdigest()
 
@@ -26,22 +128,28 @@ def main():
             continue
 
         # Identify the audio files
-        audio_l2s = sorted(args.audio_root.glob(f"{prefix_L2}_*.mp3"))
-        audio_l1s = sorted(args.audio_root.glob(f"{prefix_L1}_*.mp3"))
-        assert len(audio_l1s) == 1
-        audio_l1 = audio_l1s[0]
-
-        audio = None
-        # speak L1, L2 alternatively
-        for f in audio_l2s:
-            audio = AudioSegment.from_file(audio_l1) if audio is None else (audio + AudioSegment.from_file(audio_l1))
-            # add 1 second pause in between utterances
-            audio += AudioSegment.silent(duration=1000)
-            audio += AudioSegment.from_file(f)
-            audio += AudioSegment.silent(duration=1000)
-        # add 5 seconds pause after each words
-        audio += AudioSegment.silent(duration=5000)
-        audio.export(save_to, format="mp3")
+        audio_l2s = prefix2files.get(prefix_L2, [])
+        audio_l1s = prefix2files.get(prefix_L1, [])
+        if len(audio_l1s) != 1:
+            logging.warning("Expected 1 L1 audio for %s, found %s. Skipped.", s_L1, len(audio_l1s))
+            continue
+        if not audio_l2s:
+            # Otherwise the file would be silence only, and considered done on the next run
+            logging.warning("No L2 audio for %s yet. Skipped.", s_L2)
+            continue
+        jobs.append((audio_l1s[0], audio_l2s, save_to, args.mode))
+
+    with concurrent.futures.ProcessPoolExecutor(args.workers) as executor:
+        futures = {executor.submit(merge, *job): job[2] for job in jobs}
+        modes = []
+        for future in tqdm.tqdm(concurrent.futures.as_completed(futures), total=len(futures)):
+            try:
+                modes.append(future.result())
+            except Exception as e:
+                # e.g. a truncated or undecodable input; rerun after regenerating it
+                logging.error("Failed to merge %s: %s", futures[future], e)
+    print(f"Merged {modes.count('copy')} by copying frames, {modes.count('decode')} by re-encoding, "
+          f"{len(jobs) - len(modes)} failed.")
 
 
 if __name__ == '__main__':
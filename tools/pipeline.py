@@ -0,0 +1,364 @@
+"""Run LLM → translation → TTS (→ merged audio) and image generation as one streaming pipeline.
+
+Unlike running the scripts one after another (see `samples/`), each word flows
+through the stages as soon as the previous stage is done with it, so the first
+sentences become servable within seconds and the total time approaches that
+of the slowest stage. Each stage has its own number of workers and a bounded
+input queue, so that a fast stage cannot run arbitrarily far ahead of a slow
+one.
+
+The outputs are the same files as the scripts write, and the existing ones are
+reused, so an interrupted run resumes where it stopped.
+
+    LOGLEVEL=INFO python tools/pipeline.py assets/hi hi en Hindi Devanagari \\
+        "{'hi': ['hi-IN-Neural2-A'], 'en': ['en-US-Wavenet-H']}" \\
+        --prompt-json assets/comfyui.json --api http://localhost:8188 --merge
+"""
+import argparse
+import ast
+import asyncio
+import hashlib
+import html
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+
+import openai
+import pandas as pd
+
+import cas
+import comfyui
+import image_raw
+import llm
+import merge_audio
+import translate
+import tts
+
+_DONE = object()
+
+
+class Stage:
+    """Workers consuming a bounded queue. `fn(item)` returns `(cached, outputs)`; outputs go to all `downstream` stages."""
+
+    def __init__(self, name: str, fn, workers: int, queue_size: int, downstream: list["Stage"] = ()) -> None:
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.queue = queue.Queue(queue_size)
+        self.downstream = list(downstream)
+        self.n_done = 0
+        self.n_cached = 0
+        self.n_failed = 0
+        self.started_at = None
+        self.first_done_at = None
+        self._n_running = workers
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def start(self) -> None:
+        self.started_at = time.monotonic()
+        self._threads = [threading.Thread(target=self._work, daemon=True) for _ in range(self.workers)]
+        for t in self._threads:
+            t.start()
+
+    def put(self, item) -> None:
+        """Blocks while the queue is full."""
+        self.queue.put(item)
+
+    def close(self) -> None:
+        """No more items will be put. Downstream stages are closed once this one is drained."""
+        for _ in range(self.workers):
+            self.queue.put(_DONE)
+
+    def join(self) -> None:
+        for t in self._threads:
+            t.join()
+
+    def _work(self) -> None:
+        while (item := self.queue.get()) is not _DONE:
+            try:
+                cached, outputs = self.fn(item)
+            except Exception:
+                logging.exception("%s failed on %s", self.name, item)
+                with self._lock:
+                    self.n_failed += 1
+                continue
+            with self._lock:
+                self.n_done += 1
+                self.n_cached += cached
+                if self.first_done_at is None:
+                    self.first_done_at = time.monotonic()
+            for output in outputs:
+                for stage in self.downstream:
+                    stage.put(output)
+        with self._lock:
+            self._n_running -= 1
+            last = self._n_running == 0
+        if last:
+            for stage in self.downstream:
+                stage.close()
+
+    def report(self) -> str:
+        elapsed = time.monotonic() - self.started_at
+        rate = (self.n_done - self.n_cached) / elapsed if elapsed > 0 else 0
+        return (
+            f"{self.name}: {self.n_done} done ({self.n_cached} cached, {self.n_failed} failed), "
+            f"{rate:.2f}/s, queue {self.queue.qsize()}/{self.queue.maxsize}"
+        )
+
+
+class LLMStage:
+    """Example sentences of a word. The async client of `llm.py` runs in its own event loop thread."""
+
+    def __init__(self, args, store: cas.Store | None) -> None:
+        self.args = args
+        self.store = store
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        asyncio.run_coroutine_threadsafe(self._init(), self.loop).result()
+
+    async def _init(self) -> None:
+        # Retries are done by `llm.generate`, with jitter and the rate limit in mind
+        self.client = openai.AsyncOpenAI(max_retries=0)
+        self.limiter = llm.RateLimiter(self.args.requests_per_minute, self.args.tokens_per_minute)
+        self.semaphore = asyncio.Semaphore(self.args.llm_workers)
+
+    def __call__(self, item: tuple[int, str, str]) -> tuple[bool, list]:
+        rank, word, word_description = item
+        save_to = self.args.root / "llm" / f"{rank:0>5}.json"
+        cached = save_to.exists()
+        if not cached:
+            query_str = llm.query_string(rank, word, word_description, self.args.name, self.args.script)
+            coroutine = llm.generate(self.client, self.limiter, self.semaphore, query_str, word, save_to, self.args.max_retries, self.store)
+            if not asyncio.run_coroutine_threadsafe(coroutine, self.loop).result():
+                raise RuntimeError(f"Failed to generate sentences for {word}")
+        return cached, [json.loads(save_to.read_text())["sentences"]]
+
+
+class TranslateStage:
+    """Translations of the sentences of a word, journaled like `translate.py`."""
+
+    def __init__(self, args, store: cas.Store | None) -> None:
+        self.save_to = args.root / f"translation_{args.L1}.json"
+        self.client = translate.CLIENTS[args.translate_client](args.L2, args.L1)
+        self.store = store
+        self.model = f"{args.translate_client}:{args.L2}:{args.L1}"
+        self.translations = translate.load(self.save_to)
+        self.journal = translate.journal_path(self.save_to).open("a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def __call__(self, sentences: list[str]) -> tuple[bool, list]:
+        with self._lock:
+            todo = list(dict.fromkeys(s for s in sentences if s not in self.translations))
+        if todo:
+            texts = translate.translate_cached(self.client, self.store, self.model, todo, self.save_to)
+            with self._lock:
+                for s, text in zip(todo, texts):
+                    # Unescape HTML entities
+                    text = html.unescape(text)
+                    self.translations[s] = text
+                    # Workers may still run after an interrupted run closed the journal; the next run retranslates
+                    if not self.journal.closed:
+                        self.journal.write(json.dumps([s, text], ensure_ascii=False) + "\n")
+                if not self.journal.closed:
+                    self.journal.flush()
+        with self._lock:
+            return not todo, [(s, self.translations[s]) for s in dict.fromkeys(sentences) if s in self.translations]
+
+    def close(self) -> None:
+        with self._lock:
+            self.journal.close()
+            translate.compact(self.save_to, self.translations)
+
+
+class TTSStage:
+    """Audio files of a sentence pair in all voices, like `tts.py`."""
+
+    def __init__(self, args, store: cas.Store | None) -> None:
+        self.args = args
+        self.store = store
+        self.synthesizer = tts.SYNTHESIZERS[args.tts_client]()
+        self.limiter = tts.RateLimiter(args.qps)
+        self._claimed = {}  # The same text may come from several sentence pairs; path to event set when written
+        self._lock = threading.Lock()
+
+    def __call__(self, pair: tuple[str, str]) -> tuple[bool, list]:
+        s_L2, s_L1 = pair
+        lang_code2s = {self.args.L2: s_L2, self.args.L1: s_L1}
+        cached = True
+        for lang_code, names in self.args.voices.items():
+            s = lang_code2s[lang_code]
+            prefix = hashlib.sha256(s.encode('utf8')).hexdigest()
+            for name in names:
+                save_to = self.args.root / "audio" / f"{prefix}_{name}.mp3"
+                with self._lock:
+                    written = self._claimed.get(save_to)
+                    if written is None:
+                        if save_to.exists():
+                            continue
+                        self._claimed[save_to] = threading.Event()
+                if written is not None:
+                    written.wait()  # Synthesized for another pair
+                    continue
+                try:
+                    cached &= tts.synthesize(self.synthesizer, self.limiter, self.store, self.args.tts_client, s, name, save_to)
+                finally:
+                    # Later pairs find the file, or retry if it failed
+                    with self._lock:
+                        self._claimed.pop(save_to).set()
+        return cached, [pair]
+
+
+class ImageStage:
+    """Image of a sentence pair, like `image_raw.py`."""
+
+    def __init__(self, args, store: cas.Store | None) -> None:
+        self.args = args
+        self.store = store
+        self.pool = comfyui.from_args(args)
+        self.comfyui_prompt_text = json.dumps({"prompt": json.loads(args.prompt_json.read_text())})
+        self.model = image_raw.model_id(args.prompt_json.read_text(), args.additional_prompt)
+
+    def __call__(self, pair: tuple[str, str]) -> tuple[bool, list]:
+        s_from, s_to = pair
+        text = self.args.use == 'from' and s_from or s_to
+        sentence_id = hashlib.sha256(text.encode('utf8')).hexdigest()
+        save_to = self.args.image_root / f"{sentence_id}.png"
+        if save_to.exists() or (self.store is not None and self.store.get("image", self.model, text, save_to)):
+            return True, []
+        prompt_text = image_raw.build_prompt(self.comfyui_prompt_text, text, sentence_id, self.args.additional_prompt)
+        self.pool.generate(prompt_text, save_to)
+        if self.store is not None:
+            self.store.add("image", self.model, text, save_to)
+        return False, []
+
+
+class MergeStage:
+    """Merged audio of a sentence pair, like `merge_audio.py`."""
+
+    def __init__(self, args) -> None:
+        self.args = args
+
+    def __call__(self, pair: tuple[str, str]) -> tuple[bool, list]:
+        s_L2, s_L1 = pair
+        prefix_L1 = hashlib.sha256(s_L1.encode('utf8')).hexdigest()
+        prefix_L2 = hashlib.sha256(s_L2.encode('utf8')).hexdigest()
+        save_to = self.args.root / "audio_per_word" / f"{prefix_L1}.mp3"
+        if save_to.exists():
+            return True, []
+        audio_root = self.args.root / "audio"
+        audio_l1 = audio_root / f"{prefix_L1}_{self.args.voices[self.args.L1][0]}.mp3"
+        audio_l2s = [audio_root / f"{prefix_L2}_{name}.mp3" for name in sorted(self.args.voices[self.args.L2])]
+        merge_audio.merge(audio_l1, audio_l2s, save_to, "auto")
+        return False, []
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("root", type=Path, help="e.g. assets/hi. Containing frequency.csv")
+    parser.add_argument("L2", type=str, help="Language code of the sentences, e.g. hi")
+    parser.add_argument("L1", type=str, help="Language code to translate to, e.g. en")
+    parser.add_argument("name", type=str, help="Name of the language. e.g. English, Hindi, ...")
+    parser.add_argument("script", type=str, help="Name of script in the language. e.g. Alphabet, Devanagari, Hangul, ...")
+    parser.add_argument("voices", type=ast.literal_eval,
+                        help='Lang code to voice dictionary, as for tools/tts.py. e.g. {"hi": ["hi-IN-Neural2-A"], "en": ["en-US-Wavenet-H"]}')
+    parser.add_argument("--max-words", type=int, default=1000)
+    parser.add_argument("--queue-size", type=int, default=32, help="Items waiting in front of each stage")
+    parser.add_argument("--report-interval", type=float, default=10, help="Seconds between throughput reports")
+
+    group = parser.add_argument_group("llm")
+    group.add_argument("--llm-workers", type=int, default=8)
+    group.add_argument("--requests-per-minute", type=int)
+    group.add_argument("--tokens-per-minute", type=int)
+    group.add_argument("--max-retries", type=int, default=8)
+
+    group = parser.add_argument_group("translation")
+    group.add_argument("--translate-client", choices=list(translate.CLIENTS), default="google")
+    group.add_argument("--translate-workers", type=int, default=4)
+
+    group = parser.add_argument_group("tts")
+    group.add_argument("--tts-client", choices=list(tts.SYNTHESIZERS), default="google")
+    group.add_argument("--tts-workers", type=int, default=8)
+    group.add_argument("--qps", type=float)
+
+    group = parser.add_argument_group("image", "Images are generated only if --api is given.")
+    group.add_argument("--image-root", type=Path, help="Defaults to <root>/image-horizontal, served by the backend")
+    group.add_argument("--use", choices=['from', 'to'], default='to')
+    group.add_argument("--prompt-json", type=Path)
+    group.add_argument("--additional-prompt", type=str, default="")
+    comfyui.add_arguments(group, required=False)
+
+    group = parser.add_argument_group("merge")
+    group.add_argument("--merge", action="store_true", help="Also merge the audio into <root>/audio_per_word")
+    group.add_argument("--merge-workers", type=int, default=os.cpu_count())
+    cas.add_arguments(parser)
+    args = parser.parse_args()
+    args.image_root = args.image_root or args.root / "image-horizontal"
+    if args.api and args.prompt_json is None:
+        parser.error("--prompt-json is required with --api")
+
+    for d in ["llm", "audio"] + (["audio_per_word"] if args.merge else []):
+        (args.root / d).mkdir(parents=True, exist_ok=True)
+
+    store = cas.from_args(args)
+
+    # Build the stages from the last one
+    stages = []
+    if args.merge:
+        stages.append(Stage("merge", MergeStage(args), args.merge_workers, args.queue_size))
+    tts_stage = Stage("tts", TTSStage(args, store), args.tts_workers, args.queue_size, stages[:])
+    stages.insert(0, tts_stage)
+    to_translated = [tts_stage]
+    if args.api:
+        args.image_root.mkdir(parents=True, exist_ok=True)
+        image_workers = len(args.api) * args.queue_depth
+        image_stage = Stage("image", ImageStage(args, store), image_workers, args.queue_size)
+        stages.insert(1, image_stage)
+        to_translated.append(image_stage)
+    translator = TranslateStage(args, store)
+    stages.insert(0, Stage("translate", translator, args.translate_workers, args.queue_size, to_translated))
+    stages.insert(0, Stage("llm", LLMStage(args, store), args.llm_workers, args.queue_size, [stages[0]]))
+
+    started_at = time.monotonic()
+    for stage in stages:
+        stage.start()
+
+    stop_reporting = threading.Event()
+
+    def report_periodically():
+        while not stop_reporting.wait(args.report_interval):
+            for stage in stages:
+                logging.info(stage.report())
+
+    threading.Thread(target=report_periodically, daemon=True).start()
+
+    df = pd.read_csv(args.root / "frequency.csv")
+    try:
+        for rank, _, word, word_description in df.head(args.max_words).itertuples(index=False):  # ignore frequency
+            stages[0].put((rank, word, word_description))
+        stages[0].close()
+        for stage in stages:
+            stage.join()
+    finally:
+        stop_reporting.set()
+        translator.close()
+
+    for stage in stages:
+        logging.info(stage.report())
+    if tts_stage.first_done_at is not None:
+        logging.info("First servable sentence after %.1f seconds", tts_stage.first_done_at - started_at)
+    logging.info("Done in %.1f seconds", time.monotonic() - started_at)
+    cas.log_statistics(store)
+    n_failed = sum(stage.n_failed for stage in stages)
+    if n_failed > 0:
+        logging.error("%s items failed. Run again to retry.", n_failed)
+
+
+if __name__ == '__main__':
+    LOGLEVEL = os.environ.get('LOGLEVEL', 'INFO').upper()
+    logging.basicConfig(level=LOGLEVEL, format="%(asctime)s %(message)s")
+    main()
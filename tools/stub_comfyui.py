@@ -0,0 +1,77 @@
+"""Local stub of a ComfyUI server, to test and benchmark `tools/comfyui.py` offline.
+
+Prompts are "executed" one after another, each taking `--latency` seconds like a single GPU would.
+Completion is only exposed via `/history`, so clients fall back to polling.
+
+    python tools/stub_comfyui.py --port 8188 --latency 1 &
+"""
+import argparse
+import json
+import logging
+import threading
+import time
+import urllib.parse
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# A 1x1 PNG
+PNG = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6360000002000154a24f5d0000000049454e44ae426082"
+)
+
+
+def make_handler(latency: float):
+    lock = threading.Lock()
+    finish_at = {}  # prompt id -> time when the prompt is done
+    last = [0.]
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive
+
+        def do_POST(self):
+            json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            prompt_id = str(uuid.uuid4())
+            with lock:
+                last[0] = max(last[0], time.monotonic()) + latency
+                finish_at[prompt_id] = last[0]
+            self._reply(200, json.dumps({"prompt_id": prompt_id, "number": len(finish_at)}).encode('utf8'))
+
+        def do_GET(self):
+            url = urllib.parse.urlsplit(self.path)
+            if url.path.startswith("/history/"):
+                prompt_id = url.path[len("/history/"):]
+                history = {}
+                if finish_at.get(prompt_id, float("inf")) <= time.monotonic():
+                    history[prompt_id] = {"outputs": {"9": {"images": [
+                        {"filename": f"{prompt_id}.png", "subfolder": "", "type": "output"}
+                    ]}}}
+                self._reply(200, json.dumps(history).encode('utf8'))
+            elif url.path == "/view":
+                self._reply(200, PNG, "image/png")
+            else:
+                self._reply(404, b"{}")
+
+        def _reply(self, status: int, payload: bytes, content_type: str = "application/json"):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            logging.debug(format, *args)
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8188)
+    parser.add_argument("--latency", type=float, default=1., help="Seconds per prompt")
+    args = parser.parse_args()
+    ThreadingHTTPServer(("localhost", args.port), make_handler(args.latency)).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""Local stub of the OpenAI chat completions API, to test and benchmark the LLM tools offline.
+
+    python tools/stub_openai.py --port 8010 --latency 0.5 --rate-limit 0.1 &
+    OPENAI_BASE_URL=http://localhost:8010/v1 OPENAI_API_KEY=stub python tools/llm.py ...
+"""
+import argparse
+import json
+import logging
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def make_handler(latency: float, rate_limit: float):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            if random.random() < rate_limit:
+                self._reply(429, {"error": {"message": "Rate limit reached", "type": "rate_limit_exceeded"}},
+                            {"retry-after": "0.1"})
+                return
+            time.sleep(latency)
+            prompt = body["messages"][-1]["content"]
+            content = json.dumps({"sentences": [f"Sentence {i} for: {prompt[:40]}" for i in range(10)]})
+            self._reply(200, {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body["model"],
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": content}}],
+                "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4,
+                          "total_tokens": (len(prompt) + len(content)) // 4},
+            })
+
+        def _reply(self, status: int, data: dict, headers: dict = {}):
+            payload = json.dumps(data).encode('utf8')
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            for k, v in headers.items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            logging.debug(format, *args)
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8010)
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds per completion")
+    parser.add_argument("--rate-limit", type=float, default=0., help="Probability of replying 429")
+    args = parser.parse_args()
+    ThreadingHTTPServer(("localhost", args.port), make_handler(args.latency, args.rate_limit)).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,119 @@
+"""Translate the sentences generated by `tools/llm.py`.
+
+Sentences are sent in batches, several batches in flight at once. Progress is
+appended to a journal (`<save_to>.journal.jsonl`) which is compacted into
+`save_to` at the end, so an interrupted run resumes where it stopped.
+"""
 import argparse
+import concurrent.futures
 import html
 import json
+import logging
+import os
 import pathlib
+import time
 from os import environ
 
 import tqdm
-from google.cloud import translate
 
-# Setting project id for GCP
-PROJECT_ID = environ.get("PROJECT_ID", "")
-assert PROJECT_ID
-PARENT = f"projects/{PROJECT_ID}"
+import cas
+
+
+class GoogleTranslator:
+    """GCP Translate API"""
+
+    def __init__(self, from_lang: str, to_lang: str) -> None:
+        from google.cloud import translate
+
+        # Setting project id for GCP
+        PROJECT_ID = environ.get("PROJECT_ID", "")
+        assert PROJECT_ID
+        self.parent = f"projects/{PROJECT_ID}"
+        self.client = translate.TranslationServiceClient()
+        self.from_lang = from_lang
+        self.to_lang = to_lang
+
+    def translate(self, texts: list[str]) -> list[str]:
+        response = self.client.translate_text(
+            contents=texts,
+            parent=self.parent,
+            source_language_code=self.from_lang,
+            target_language_code=self.to_lang,
+        )
+        return [t.translated_text for t in response.translations]
+
+
+class FakeTranslator:
+    """Offline stand-in with a fixed latency per request, for testing and benchmarking."""
+
+    def __init__(self, from_lang: str, to_lang: str, latency: float = 0.1) -> None:
+        self.to_lang = to_lang
+        self.latency = latency
+
+    def translate(self, texts: list[str]) -> list[str]:
+        time.sleep(self.latency)
+        return [f"[{self.to_lang}] {t}" for t in texts]
+
+
+CLIENTS = {"google": GoogleTranslator, "fake": FakeTranslator}
+
+
+def batches(sentences: list[str], max_sentences: int, max_chars: int):
+    """Split into batches of at most `max_sentences` sentences and `max_chars` characters."""
+    batch, n_chars = [], 0
+    for s in sentences:
+        if batch and (len(batch) >= max_sentences or n_chars + len(s) > max_chars):
+            yield batch
+            batch, n_chars = [], 0
+        batch.append(s)
+        n_chars += len(s)
+    if batch:
+        yield batch
+
+
+def translate_cached(client, store: cas.Store | None, model: str, texts: list[str], ref: pathlib.Path) -> list[str]:
+    """Translate the texts the store does not have yet, in one request."""
+    if store is None:
+        return client.translate(texts)
+    cached = {s: store.get_text("translate", model, s, ref) for s in texts}
+    todo = [s for s, t in cached.items() if t is None]
+    if todo:
+        for s, t in zip(todo, client.translate(todo)):
+            store.add_text("translate", model, s, t, ref)
+            cached[s] = t
+    return [cached[s] for s in texts]
+
+
+def journal_path(save_to: pathlib.Path) -> pathlib.Path:
+    return save_to.with_name(f"{save_to.name}.journal.jsonl")
+
+
+def load(save_to: pathlib.Path) -> dict[str, str]:
+    """Translations so far: the compacted json, plus the journal of an interrupted run."""
+    try:
+        translations = json.loads(save_to.read_text())
+    except FileNotFoundError:
+        translations = {}
+    try:
+        with journal_path(save_to).open(encoding="utf-8") as f:
+            for l in f:
+                try:
+                    s, t = json.loads(l)
+                except json.decoder.JSONDecodeError:
+                    logging.warning("Ignoring a truncated journal entry: %s", l)
+                    continue
+                translations[s] = t
+    except FileNotFoundError:
+        pass
+    return translations
+
+
+def compact(save_to: pathlib.Path, translations: dict[str, str]) -> None:
+    tmp = save_to.with_name(f".{save_to.name}.tmp")
+    with tmp.open("w") as f:
+        json.dump(translations, f, indent=2)
+    os.replace(tmp, save_to)
+    journal_path(save_to).unlink(missing_ok=True)
 
 
 def main():
@@ -19,40 +122,56 @@ def main():
     parser.add_argument("save_to", type=pathlib.Path)
     parser.add_argument("--from-lang", type=str)
     parser.add_argument("--to-lang", type=str)
+    parser.add_argument("--client", choices=list(CLIENTS), default="google",
+                        help="Translation API. 'fake' works offline.")
+    parser.add_argument("--batch-size", type=int, default=100, help="Maximum sentences per request")
+    parser.add_argument("--batch-chars", type=int, default=5000, help="Maximum characters per request")
+    parser.add_argument("--workers", type=int, default=4, help="Maximum requests in flight")
+    cas.add_arguments(parser)
     args = parser.parse_args()
 
     args.save_to.parent.mkdir(parents=True, exist_ok=True)
 
-    client = translate.TranslationServiceClient()
-
-    try:
-        hi2en = json.loads(args.save_to.read_text())
-    except FileNotFoundError:
-        hi2en = {}
+    client = CLIENTS[args.client](args.from_lang, args.to_lang)
+    store = cas.from_args(args)
+    model = f"{args.client}:{args.from_lang}:{args.to_lang}"
 
-    i_update = 0
-    for p in tqdm.tqdm(sorted(args.llm.glob("*.json"))):
+    hi2en = load(args.save_to)
+    todo = []
+    for p in sorted(args.llm.glob("*.json")):
         d = json.loads(p.read_text())
-        for s in tqdm.tqdm(d['sentences'], leave=False):
-            if s in hi2en:
-                continue
-            response = client.translate_text(
-                contents=[s],
-                parent=PARENT,
-                source_language_code=args.from_lang,
-                target_language_code=args.to_lang,
-            )
-            text = response.translations[0].translated_text
-            # Unescape HTML entities
-            text = html.unescape(text)
-            hi2en[s] = text
-            i_update += 1
-
-        if i_update % 100 == 0:
-            with args.save_to.open("w") as f:
-                json.dump(hi2en, f, indent=2)
-    with args.save_to.open("w") as f:
-        json.dump(hi2en, f, indent=2)
+        todo += [s for s in d['sentences'] if s not in hi2en]
+    todo = list(dict.fromkeys(todo))  # Deduplicate, keeping the order
+
+    with (
+        journal_path(args.save_to).open("a", encoding="utf-8") as journal,
+        concurrent.futures.ThreadPoolExecutor(args.workers) as executor,
+        tqdm.tqdm(total=len(todo)) as pbar,
+    ):
+        in_flight = set()
+
+        def write(future: concurrent.futures.Future):
+            batch, texts = future.result()
+            for s, text in zip(batch, texts):
+                # Unescape HTML entities
+                text = html.unescape(text)
+                hi2en[s] = text
+                journal.write(json.dumps([s, text], ensure_ascii=False) + "\n")
+            journal.flush()
+            pbar.update(len(batch))
+
+        for batch in batches(todo, args.batch_size, args.batch_chars):
+            # Bound the number of batches in flight
+            if len(in_flight) >= args.workers * 2:
+                done, in_flight = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    write(future)
+            in_flight.add(executor.submit(lambda b: (b, translate_cached(client, store, model, b, args.save_to)), batch))
+        for future in concurrent.futures.as_completed(in_flight):
+            write(future)
+
+    compact(args.save_to, hi2en)
+    cas.log_statistics(store)
 
 
 if __name__ == "__main__":
@@ -1,18 +1,123 @@
-"""Using google text to speech API to generate audio files for the words"""
+"""Using google text to speech API to generate audio files for the words
+
+(sentence, voice) jobs are synthesized by a pool of workers under a QPS
+ceiling. Identical texts are synthesized once per voice, and files are
+written via a temporary file, so an interrupted run never leaves a truncated
+mp3 behind for the skip-if-exists check.
+"""
 import argparse
 import ast
+import concurrent.futures
 import hashlib
+import itertools
 import json
+import logging
+import os
+import threading
+import time
 from pathlib import Path
 
 import tqdm
-from google.cloud import texttospeech
 
-client = texttospeech.TextToSpeechClient()
-audio_config = texttospeech.AudioConfig(
-    audio_encoding=texttospeech.AudioEncoding.MP3,
-    speaking_rate=1.0,
-)
+import cas
+
+
+class GoogleSynthesizer:
+    """GCP Text-to-Speech API"""
+
+    def __init__(self) -> None:
+        from google.cloud import texttospeech
+        self.texttospeech = texttospeech
+        self.client = texttospeech.TextToSpeechClient()
+        self.audio_config = texttospeech.AudioConfig(
+            audio_encoding=texttospeech.AudioEncoding.MP3,
+            speaking_rate=1.0,
+        )
+
+    def synthesize(self, text: str, name: str) -> bytes:
+        voice = self.texttospeech.VoiceSelectionParams(
+            language_code="-".join(name.split("-")[:2]),
+            name=name,
+        )
+        response = self.client.synthesize_speech(
+            input=self.texttospeech.SynthesisInput(text=text),
+            voice=voice,
+            audio_config=self.audio_config
+        )
+        # The response's audio_content is binary.
+        return response.audio_content
+
+
+class FakeSynthesizer:
+    """Offline stand-in with a fixed latency per request, for testing and benchmarking."""
+    # A silent MPEG-1 Layer III frame (128 kbps, 44.1 kHz)
+    FRAME = b"\xff\xfb\x90\x64" + b"\x00" * 413
+
+    def __init__(self, latency: float = 0.1) -> None:
+        self.latency = latency
+
+    def synthesize(self, text: str, name: str) -> bytes:
+        time.sleep(self.latency)
+        return self.FRAME * (1 + len(text) // 4)
+
+
+SYNTHESIZERS = {"google": GoogleSynthesizer, "fake": FakeSynthesizer}
+
+
+class RateLimiter:
+    """Spaces out calls to at most `qps` per second, across threads."""
+
+    def __init__(self, qps: float | None) -> None:
+        self.interval = 0 if qps is None else 1 / qps
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            t = max(now, self._next)
+            self._next = t + self.interval
+        time.sleep(t - now)
+
+
+def write_atomic(save_to: Path, content: bytes) -> None:
+    tmp = save_to.with_name(f".{save_to.name}.tmp")
+    tmp.write_bytes(content)
+    os.replace(tmp, save_to)
+
+
+def synthesize(synthesizer, limiter: RateLimiter, store: cas.Store | None, client: str,
+               text: str, name: str, save_to: Path) -> bool:
+    """Synthesize into `save_to` unless the store has it already. Returns whether it was cached."""
+    model = f"{client}:{name}"
+    if store is not None and store.get("tts", model, text, save_to):
+        return True
+    limiter.wait()
+    write_atomic(save_to, synthesizer.synthesize(text, name))
+    if store is not None:
+        store.add("tts", model, text, save_to)
+    return False
+
+
+def jobs(s2s: dict[str, str], out_root: Path, L2: str, L1: str, lang_code2names: dict[str, list[str]]) -> list[tuple[str, str, Path]]:
+    """`(text, voice name, save_to)` to synthesize, interleaving voices so that no voice's quota is hit in a burst."""
+    per_voice = {}
+    for s_L2, s_L1 in sorted(s2s.items()):
+        lang_code2s = {L2: s_L2, L1: s_L1}
+        for lang_code, names in lang_code2names.items():
+            s = lang_code2s[lang_code]
+            prefix = hashlib.sha256(s.encode('utf8')).hexdigest()
+            for name in names:
+                save_to = out_root / f"{prefix}_{name}.mp3"
+                if save_to.exists():
+                    continue
+                # Same text and voice, same file: dedupe
+                per_voice.setdefault(name, {})[save_to] = (s, name, save_to)
+    return [
+        job
+        for jobs_of_voices in itertools.zip_longest(*(list(d.values()) for d in per_voice.values()))
+        for job in jobs_of_voices if job is not None
+    ]
 
 
 def main():
@@ -26,35 +131,32 @@ def main():
                         'e.g. {"hi": ["hi-IN-Wavenet-A", "hi-IN-Wavenet-E",], "en": ["en-US-Wavenet-H",]}. ' +
                         'For available options, refer to https://cloud.google.com/text-to-speech/docs/voices.'
     )
+    parser.add_argument("--client", choices=list(SYNTHESIZERS), default="google",
+                        help="Text-to-speech API. 'fake' works offline.")
+    parser.add_argument("--workers", type=int, default=8, help="Maximum requests in flight")
+    parser.add_argument("--qps", type=float, help="Maximum requests per second. Unlimited by default.")
+    cas.add_arguments(parser)
     args = parser.parse_args()
     args.out_root.mkdir(parents=True, exist_ok=True)
 
-    s2s = json.loads(args.json.read_text())
-    for s_L2, s_L1 in tqdm.tqdm(sorted(s2s.items())):
-        lang_code2s = {args.L2: s_L2, args.L1: s_L1}
-        for lang_code, names in args.google_lang_code2names.items():
-            s = lang_code2s[lang_code]
-            synthesis_input = texttospeech.SynthesisInput(text=s)
-            prefix = hashlib.sha256(s.encode('utf8')).hexdigest()
-            for name in names:
-                save_to = args.out_root / f"{prefix}_{name}.mp3"
-                if save_to.exists():
-                    continue
+    synthesizer = SYNTHESIZERS[args.client]()
+    limiter = RateLimiter(args.qps)
+    store = cas.from_args(args)
 
-                voice = texttospeech.VoiceSelectionParams(
-                    language_code="-".join(name.split("-")[:2]),
-                    name=name,
-                )
-                response = client.synthesize_speech(
-                    input=synthesis_input,
-                    voice=voice,
-                    audio_config=audio_config
-                    )
-
-                # The response's audio_content is binary.
-                with save_to.open("wb") as out:
-                    # Write the response to the output file.
-                    out.write(response.audio_content)
+    s2s = json.loads(args.json.read_text())
+    todo = jobs(s2s, args.out_root, args.L2, args.L1, args.google_lang_code2names)
+    n_failed = 0
+    with concurrent.futures.ThreadPoolExecutor(args.workers) as executor:
+        futures = {executor.submit(synthesize, synthesizer, limiter, store, args.client, *job): job for job in todo}
+        for future in tqdm.tqdm(concurrent.futures.as_completed(futures), total=len(futures)):
+            try:
+                future.result()
+            except Exception:
+                logging.exception("Failed to synthesize %s", futures[future][2])
+                n_failed += 1
+    cas.log_statistics(store)
+    if n_failed > 0:
+        logging.error("Failed to synthesize %s files. Run again to retry.", n_failed)
 
 
 if __name__ == '__main__':
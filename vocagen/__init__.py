@@ -1,18 +1,66 @@
 """Reversible Linear Congruential Generator; Credit to the following link:
 https://stackoverflow.com/questions/62797012/how-to-generate-8-bytes-unique-random-number-in-python
+
+The single steps run on plain Python integers by default, which is as fast as
+a JIT kernel for a single multiplication and does not compile anything at
+startup. Set `VOCAGEN_ENGINE=numba` to use the numba kernels instead; they are
+imported on first use and cached to disk.
 """
+import functools
+import logging
+import os
+
 import numpy as np
-import numba as nb
 
+MASK = (1 << 64) - 1
+ENGINE = os.environ.get("VOCAGEN_ENGINE", "python")
+
+
+def next_(seed: np.uint64, a: np.uint64, c: np.uint64) -> int:
+    return (int(a) * int(seed) + int(c)) & MASK
+
+
+def prev(seed: np.uint64, a_inv: np.uint64, c: np.uint64) -> int:
+    return (int(a_inv) * (int(seed) - int(c))) & MASK
+
+
+@functools.cache
+def _kernels(engine: str):
+    """`(next_, prev)` of the engine. Falls back to Python if numba is unavailable."""
+    if engine == "numba":
+        try:
+            from . import _numba
+            return _numba.next_, _numba.prev
+        except ImportError:
+            logging.warning("numba is not available. Falling back to the python engine.")
+    elif engine != "python":
+        raise ValueError(f"Unknown engine {engine}")
+    return next_, prev
 
-@nb.jit
-def next_(seed: np.uint64, a: np.uint64, c: np.uint64) -> np.uint64:
-    return a * seed + c
 
+def _power(a: int, c: int, k: int) -> tuple[int, int]:
+    """Compose the affine map `x -> a * x + c` (mod 2**64) `k` times, by repeated squaring."""
+    a_k, c_k = 1, 0
+    while k > 0:
+        if k & 1:
+            a_k, c_k = (a * a_k) & MASK, (a * c_k + c) & MASK
+        a, c = (a * a) & MASK, (a * c + c) & MASK
+        k >>= 1
+    return a_k, c_k
 
-@nb.jit
-def prev(seed: np.uint64, a_inv: np.uint64, c: np.uint64) -> np.uint64:
-    return a_inv * (seed - c)
+
+def _scan(a: int, c: int, seed: int, n: int) -> np.ndarray:
+    """`n` successive images of `seed` under `x -> a * x + c`, vectorized (prefix scan of the affine maps)."""
+    a_s = np.full(n, a, dtype=np.uint64)
+    c_s = np.full(n, c, dtype=np.uint64)
+    shift = 1
+    while shift < n:
+        # Element j becomes (map j) after (map j - shift); uint64 arithmetic wraps around
+        a_prev, c_prev = a_s[:-shift].copy(), c_s[:-shift].copy()
+        c_s[shift:] = a_s[shift:] * c_prev + c_s[shift:]
+        a_s[shift:] = a_s[shift:] * a_prev
+        shift *= 2
+    return a_s * np.uint64(seed) + c_s
 
 
 class ReversibleRandom:
@@ -23,17 +71,55 @@ class ReversibleRandom:
     A_inv: np.uint64 = np.uint64(13877824140714322085)
     C: np.uint64 = UONE
 
-    def __init__(self, seed: np.uint64,) -> None:
+    def __init__(self, seed: np.uint64, engine: str | None = None) -> None:
         self._seed: np.uint64 = np.uint64(seed)
+        self._next, self._prev = _kernels(engine or ENGINE)
 
+    # Kernels return Python ints (numba boxes uint64 as int too); seeds are np.uint64 throughout
     def next(self) -> np.uint64:
-        self._seed = next_(self._seed, self.A, self.C)
+        self._seed = np.uint64(self._next(np.uint64(self._seed), self.A, self.C))
         return self._seed
 
     def prev(self) -> np.uint64:
-        self._seed = prev(self._seed, self.A_inv, self.C)
+        self._seed = np.uint64(self._prev(np.uint64(self._seed), self.A_inv, self.C))
+        return self._seed
+
+    def _prev_map(self) -> tuple[int, int]:
+        # a_inv * (x - c) = a_inv * x - a_inv * c
+        return int(self.A_inv), (-int(self.A_inv) * int(self.C)) & MASK
+
+    def advance(self, k: int) -> np.uint64:
+        """Same as calling `next()` `k` times, in O(log k)."""
+        if k < 0:
+            return self.rewind(-k)
+        a_k, c_k = _power(int(self.A), int(self.C), k)
+        self._seed = np.uint64((a_k * int(self._seed) + c_k) & MASK)
         return self._seed
 
+    def rewind(self, k: int) -> np.uint64:
+        """Same as calling `prev()` `k` times, in O(log k)."""
+        if k < 0:
+            return self.advance(-k)
+        a_k, c_k = _power(*self._prev_map(), k)
+        self._seed = np.uint64((a_k * int(self._seed) + c_k) & MASK)
+        return self._seed
+
+    def next_n(self, n: int) -> np.ndarray:
+        """Values of `n` calls to `next()`, as a uint64 array."""
+        if n <= 0:
+            return np.empty(0, dtype=np.uint64)
+        values = _scan(int(self.A), int(self.C), int(self._seed), n)
+        self._seed = values[-1]
+        return values
+
+    def prev_n(self, n: int) -> np.ndarray:
+        """Values of `n` calls to `prev()`, as a uint64 array."""
+        if n <= 0:
+            return np.empty(0, dtype=np.uint64)
+        values = _scan(*self._prev_map(), int(self._seed), n)
+        self._seed = values[-1]
+        return values
+
     def seed(self) -> np.uint64:
         return self._seed
 
@@ -0,0 +1,13 @@
+"""Numba kernels of the generator, compiled on first use and cached to disk."""
+import numba as nb
+import numpy as np
+
+
+@nb.njit(cache=True)
+def next_(seed: np.uint64, a: np.uint64, c: np.uint64) -> np.uint64:
+    return a * seed + c
+
+
+@nb.njit(cache=True)
+def prev(seed: np.uint64, a_inv: np.uint64, c: np.uint64) -> np.uint64:
+    return a_inv * (seed - c)